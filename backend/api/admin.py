@@ -44,5 +44,4 @@ class RecipeAdmin(admin.ModelAdmin):
     readonly_fields = ('favorite', )
 
     def favorite(self, obj):
-        result = obj.favorited_for.count()
-        return result
+        return obj.favorites_count
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from copy import copy
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    """Two-tier cache of authtoken objects with their users.
+
+    The first tier is a bounded LRU in process, the second an optional
+    shared Django cache named by `TOKEN_CACHE`. Entries are dropped from
+    both tiers by `delete` when a token or its user changes; other workers
+    may still serve their local copy until `TOKEN_CACHE_LOCAL_TIMEOUT`
+    expires, so that timeout is kept short.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def shared(self):
+        return caches[settings.TOKEN_CACHE] if settings.TOKEN_CACHE else None
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > monotonic():
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+        token = self.shared.get(f'token:{key}') if self.shared else None
+        if token is not None:
+            self.set_local(key, token)
+        return token
+
+    def set(self, key, token):
+        self.set_local(key, token)
+        if self.shared:
+            self.shared.set(f'token:{key}', token,
+                            settings.TOKEN_CACHE_TIMEOUT)
+
+    def set_local(self, key, token):
+        expires_at = monotonic() + settings.TOKEN_CACHE_LOCAL_TIMEOUT
+        with self.lock:
+            self.entries[key] = (expires_at, token)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        keys = list(keys)
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+        if self.shared and keys:
+            self.shared.delete_many([f'token:{key}' for key in keys])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that looks tokens up in `token_cache` first."""
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+        # Cached objects are shared between requests, hand out copies.
+        token = copy(token)
+        token.user = copy(token.user)
+        return token.user, token
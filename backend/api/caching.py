@@ -0,0 +1,193 @@
+from hashlib import md5
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404, HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from api import models, serializers
+from api.replicas import primary
+
+
+def get_version(key, cache=cache):
+    return cache.get_or_set(f'{key}:version', time, timeout=None)
+
+
+def invalidate(keys, cache=cache):
+    """Start new cache generations; older entries are never read again."""
+    now = time()
+    cache.set_many({f'{key}:version': now for key in keys}, timeout=None)
+
+
+def get_reference_key(model):
+    return f'reference:{model._meta.label_lower}'
+
+
+def invalidate_on_commit(keys, cache=cache):
+    """Invalidate once the writer commits, so no reader caches old rows."""
+    keys = list(keys)
+    if keys:
+        transaction.on_commit(lambda: invalidate(keys, cache))
+
+
+def invalidate_reference_cache(model):
+    invalidate_on_commit([get_reference_key(model)])
+
+
+def get_recipe_cache():
+    return caches[settings.RECIPE_CACHE]
+
+
+def is_local_cache(cache):
+    """Whether `cache` lives in this process and isn't seen by others."""
+    return isinstance(cache, LocMemCache)
+
+
+def get_recipe_cache_timeout():
+    """Keep recipes briefly when other workers can't clear the cache."""
+    if is_local_cache(get_recipe_cache()):
+        return settings.RECIPE_CACHE_LOCAL_TIMEOUT
+    return settings.RECIPE_CACHE_TIMEOUT
+
+
+def invalidate_recipes(pks):
+    invalidate_on_commit([f'recipe:{pk}' for pk in pks], get_recipe_cache())
+
+
+def invalidate_user_flags(user_ids):
+    invalidate_on_commit([f'recipe-flags:{pk}' for pk in user_ids],
+                         get_recipe_cache())
+
+
+class ConditionalCacheMixin:
+    """Serve rendered JSON of read-only viewsets from the cache.
+
+    Rendered bytes are cached per URL together with a content-hash ETag, so
+    a repeated request is answered from the cache, and a request with a
+    matching `If-None-Match` or `If-Modified-Since` gets `304 Not Modified`.
+    Entries are invalidated per model by `invalidate_reference_cache` and
+    filled from the primary, so a lagging replica can't refill stale data.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request,
+                                    *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        model = self.queryset.model
+        version = get_version(get_reference_key(model))
+        path = f'{model._meta.label_lower}:{version}:{request.get_full_path()}'
+        key = f'reference:{md5(path.encode()).hexdigest()}'
+        cached = cache.get(key)
+        if cached is None:
+            with primary():
+                response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            renderer = request.accepted_renderer
+            content = renderer.render(response.data,
+                                      request.accepted_media_type,
+                                      self.get_renderer_context())
+            content_type = request.accepted_media_type
+            if renderer.charset:
+                content_type = f'{content_type}; charset={renderer.charset}'
+            etag = quote_etag(md5(content).hexdigest())
+            cached = (content, content_type, etag)
+            cache.set(key, cached, settings.REFERENCE_CACHE_TIMEOUT)
+        content, content_type, etag = cached
+        last_modified = int(version)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        ) or HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True,
+                            max_age=settings.REFERENCE_CACHE_MAX_AGE)
+        patch_vary_headers(response, ('Accept', ))
+        return response
+
+
+class RecipeDetailCacheMixin:
+    """Serve recipe detail from the cache.
+
+    The anonymous representation is cached whole and shared by all users.
+    For authenticated users the per-user flags are cached separately and
+    overlaid on it. Both are invalidated by signals, see `api.signals`. The
+    shared entry is filled from the primary and only by requests without a
+    sparse fieldset; sparse requests are cut from it.
+
+    Signals only reach the cache of their own process, so with a local
+    `RECIPE_CACHE` entries are kept for `RECIPE_CACHE_LOCAL_TIMEOUT` only.
+    Anonymous hits don't check that the recipe still exists: that would
+    cost a query per hit and still miss edits, which the timeout bounds.
+    """
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            pk = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+        recipe_cache = get_recipe_cache()
+        version = get_version(f'recipe:{pk}', recipe_cache)
+        key = f'recipe:{pk}:{version}:{request.build_absolute_uri("/")}'
+        data = recipe_cache.get(key)
+        if data is None:
+            if {'fields', 'omit'} & request.query_params.keys():
+                return super().retrieve(request, *args, **kwargs)
+            with primary():
+                response = super().retrieve(request, *args, **kwargs)
+            data = {**response.data,
+                    'author': {**response.data['author'],
+                               'is_subscribed': False},
+                    'is_favorited': False,
+                    'is_in_shopping_cart': False}
+            recipe_cache.set(key, data, get_recipe_cache_timeout())
+        data = {name: data[name]
+                for name in serializers.get_sparse_fields(request, data)}
+        if request.user.is_authenticated and data.keys() & {
+                'author', 'is_favorited', 'is_in_shopping_cart'}:
+            flags = self.get_user_flags(pk, request.user)
+            if flags is None:
+                # Deleted by another worker that couldn't clear this cache.
+                recipe_cache.delete(key)
+                raise Http404
+            if 'author' in data:
+                data['author'] = {**data['author'],
+                                  'is_subscribed': flags['is_subscribed']}
+            for name in ('is_favorited', 'is_in_shopping_cart'):
+                if name in data:
+                    data[name] = flags[name]
+        return Response(data)
+
+    def get_user_flags(self, pk, user):
+        recipe_cache = get_recipe_cache()
+        version = get_version(f'recipe-flags:{user.pk}', recipe_cache)
+        key = f'recipe-flags:{user.pk}:{version}:{pk}'
+        flags = recipe_cache.get(key)
+        if flags is None:
+            subscription = models.UserFollowing.objects.filter(
+                user=user, following_user=OuterRef('author'))
+            flags = models.Recipe.objects.filter(
+                pk=pk
+            ).annotate_user_flags(user).annotate(
+                is_subscribed=Exists(subscription)
+            ).values(
+                'is_favorited', 'is_in_shopping_cart', 'is_subscribed'
+            ).first()
+            if flags is None:
+                return None
+            recipe_cache.set(key, flags, get_recipe_cache_timeout())
+        return flags
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+
+from api.caching import is_local_cache
+
+
+@checks.register(checks.Tags.caches)
+def check_replica_pin_cache(app_configs, **kwargs):
+    """Replica pins must be seen by every worker to give read-your-writes."""
+    if settings.DATABASE_REPLICAS and is_local_cache(caches['default']):
+        return [checks.Error(
+            'Read replicas are configured, but the default cache is local '
+            'to the process, so writers are not pinned to the primary in '
+            'other workers.',
+            hint='Set CACHE_BACKEND to a shared cache, e.g. Redis.',
+            id='api.E001',
+        )]
+    return []
@@ -1,15 +1,42 @@
 import base64
-from time import time
+import binascii
+from hashlib import sha256
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.core.files import File
 from rest_framework import serializers
 
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64(data, ext):
+    """Decode base64 chunk by chunk into a file named by its sha256.
+
+    Whitespace is dropped and characters past a multiple of 4 are carried
+    to the next chunk, so line-wrapped base64 decodes as a whole would.
+    """
+    file = SpooledTemporaryFile(max_size=BASE64_CHUNK_SIZE * 16)
+    digest = sha256()
+    rest = ''
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        chunk = rest + ''.join(data[start:start + BASE64_CHUNK_SIZE].split())
+        end = len(chunk) - len(chunk) % 4
+        chunk, rest = base64.b64decode(chunk[:end]), chunk[end:]
+        digest.update(chunk)
+        file.write(chunk)
+    if rest:
+        base64.b64decode(rest)
+    file.seek(0)
+    return File(file, name=f'{digest.hexdigest()}.{ext}')
+
 
 class ImageFieldSerialiser(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            file_name = f'{int(time())}.{ext}'
-            data = ContentFile(base64.b64decode(imgstr), name=file_name)
+            try:
+                data = decode_base64(imgstr, ext)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
         return super().to_internal_value(data)
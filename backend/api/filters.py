@@ -7,8 +7,10 @@ class RecipeFilter(filters.FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=models.Tag.objects.all()
+        queryset=models.Tag.objects.all(),
+        method='get_tags',
     )
+    search = filters.CharFilter(method='get_search')
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
@@ -18,12 +20,22 @@ class RecipeFilter(filters.FilterSet):
         model = models.Recipe
         fields = ['author', 'tags']
 
+    def get_tags(self, queryset, name, value):
+        if value:
+            return queryset.with_tags([tag.id for tag in value])
+        return queryset
+
+    def get_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value.strip())
+        return queryset
+
     def get_is_favorited(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return self.request.user.favorite_list.all()
+            return queryset.favorited_by(self.request.user)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
-            return self.request.user.shopping_list.all()
+            return queryset.in_cart_of(self.request.user)
         return queryset
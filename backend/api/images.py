@@ -0,0 +1,60 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os.path import dirname, splitext
+from posixpath import join
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS,
+                              thread_name_prefix='thumbnails')
+
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+
+
+def get_thumbnail_name(image_name):
+    """Thumbnail path for an image, stable for the same image name."""
+    stem = splitext(image_name.split('/')[-1])[0]
+    return join(dirname(image_name), 'thumbs',
+                f'{stem}.{THUMBNAIL_FORMAT.lower()}')
+
+
+def make_thumbnail(recipe_id, image_name):
+    from api.models import Recipe
+
+    storage = Recipe._meta.get_field('image').storage
+    thumbnail_name = get_thumbnail_name(image_name)
+    if not storage.exists(thumbnail_name):
+        with storage.open(image_name) as file, Image.open(file) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(settings.THUMBNAIL_SIZE)
+            if THUMBNAIL_FORMAT == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, format=THUMBNAIL_FORMAT,
+                       quality=settings.THUMBNAIL_QUALITY)
+        thumbnail_name = storage.save(thumbnail_name,
+                                      ContentFile(buffer.getvalue()))
+    Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        thumbnail=thumbnail_name)
+
+
+def run_in_worker(recipe_id, image_name):
+    try:
+        make_thumbnail(recipe_id, image_name)
+    except Exception:
+        logger.exception('Could not make a thumbnail for %s', image_name)
+    finally:
+        connections.close_all()
+
+
+def schedule_thumbnail(recipe):
+    """Make the recipe thumbnail in a worker thread after commit."""
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(run_in_worker, recipe_id, image_name))
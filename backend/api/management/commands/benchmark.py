@@ -0,0 +1,128 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import mean
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from api.models import Recipe
+
+User = get_user_model()
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    index = max(round(percent / 100 * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', 'HEAD'), capture_output=True, text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = """Measure p50/p99 latency and query counts of API endpoints
+            through the Django test client and save them as json"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare',
+                            help='Earlier result file to compare with')
+        parser.add_argument('--search', default='абр')
+
+    def get_endpoints(self, options):
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        if recipe is None:
+            raise CommandError('No recipes, run generatedata first')
+        return {
+            'recipe_list': '/api/recipes/?limit=6',
+            'recipe_list_deep': '/api/recipes/?limit=6&page=50',
+            'recipe_detail': f'/api/recipes/{recipe.id}/',
+            'subscriptions': '/api/users/subscriptions/?recipes_limit=3',
+            'ingredient_search': f'/api/ingredients/?name={options["search"]}',
+            'download_shopping_cart': '/api/recipes/download_shopping_cart/',
+        }
+
+    def measure(self, client, url, count):
+        timings, queries, statuses = [], [], set()
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as context:
+                start = perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((perf_counter() - start) * 1000)
+            queries.append(len(context.captured_queries))
+            statuses.add(response.status_code)
+        timings.sort()
+        return {
+            'url': url,
+            'requests': count,
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(mean(timings), 2),
+            'queries': max(queries),
+        }
+
+    def compare(self, results, path):
+        try:
+            previous = json.loads(Path(path).read_text())['results']
+        except (OSError, KeyError, ValueError):
+            raise CommandError(f'Cannot read results from {path}')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            for key in ('p50_ms', 'p99_ms', 'queries'):
+                before, after = previous[name][key], result[key]
+                change = (after - before) / before * 100 if before else 0
+                self.stdout.write(
+                    f'{name:24} {key:8} {before:>10} -> {after:>10} '
+                    f'({change:+.1f}%)')
+
+    def handle(self, *args, **options):
+        user = User.objects.annotate(
+            follows=Count('following', distinct=True),
+            cart=Count('shopping_list', distinct=True),
+        ).order_by('-follows', '-cart').first()
+        if user is None:
+            raise CommandError('No users, run generatedata first')
+        token, _ = Token.objects.get_or_create(user=user)
+        client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, url in self.get_endpoints(options).items():
+                results[name] = self.measure(client, url,
+                                             options['requests'])
+                self.stdout.write(
+                    f'{name:24} p50 {results[name]["p50_ms"]:>8} ms  '
+                    f'p99 {results[name]["p99_ms"]:>8} ms  '
+                    f'{results[name]["queries"]} queries')
+        report = {
+            'commit': get_commit(),
+            'created': datetime.now(timezone.utc).isoformat(),
+            'scale': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+            },
+            'results': results,
+        }
+        Path(options['output']).write_text(json.dumps(report, indent=2))
+        self.stdout.write(f'Results saved to {options["output"]}')
+        if options['compare']:
+            self.compare(results, options['compare'])
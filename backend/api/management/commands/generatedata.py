@@ -0,0 +1,121 @@
+import csv
+import random
+from itertools import islice
+from pathlib import Path
+
+from django.db.models import Max
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import (Ingredient, IngredientAmount, Recipe, Tag,
+                        UserFollowing)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = """Generate a synthetic dataset for benchmarks: users, recipes
+            with ingredients from csv, follows, favorites and carts"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes-per-user', type=int, default=10)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=12)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--favorites-per-user', type=int, default=30)
+        parser.add_argument('--cart-per-user', type=int, default=10)
+        parser.add_argument('--ingredients', default='data/ingredients.csv')
+        parser.add_argument('--tags', default='data/tags.csv')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def read_csv(self, path):
+        try:
+            with Path(path).open('r') as file:
+                return list(csv.reader(file))
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {path}')
+
+    def bulk_create(self, model, objects, **kwargs):
+        objects = iter(objects)
+        while batch := list(islice(objects, self.batch_size)):
+            model.objects.bulk_create(batch, **kwargs)
+
+    def get_last_id(self, model):
+        return model.objects.aggregate(last=Max('id'))['last'] or 0
+
+    def sample(self, population, size):
+        return self.random.sample(population, min(size, len(population)))
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.bulk_create(Ingredient, (
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in self.read_csv(options['ingredients'])
+        ), ignore_conflicts=True)
+        self.bulk_create(Tag, (
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in self.read_csv(options['tags'])
+        ), ignore_conflicts=True)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+
+        last_user = self.get_last_id(User)
+        password = make_password('benchmark')
+        self.bulk_create(User, (
+            User(username=f'bench{last_user + i}',
+                 email=f'bench{last_user + i}@example.com',
+                 first_name='Bench', last_name=f'User {i}',
+                 password=password)
+            for i in range(options['users'])
+        ))
+        user_ids = list(User.objects.values_list('id', flat=True))
+        new_users = list(User.objects.filter(
+            id__gt=last_user).values_list('id', flat=True))
+
+        last_recipe = self.get_last_id(Recipe)
+        self.bulk_create(Recipe, (
+            Recipe(author_id=user_id, name=f'Recipe {user_id}.{i}',
+                   image='recipes/benchmark.png', text='Synthetic recipe',
+                   cooking_time=self.random.randint(5, 120))
+            for user_id in new_users
+            for i in range(options['recipes_per_user'])
+        ))
+        recipe_ids = list(Recipe.objects.filter(
+            id__gt=last_recipe).values_list('id', flat=True))
+        self.bulk_create(IngredientAmount, (
+            IngredientAmount(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=self.random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in self.sample(
+                ingredient_ids, options['ingredients_per_recipe'])
+        ))
+        self.bulk_create(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.sample(tag_ids, 2)
+        ))
+
+        self.bulk_create(UserFollowing, (
+            UserFollowing(user_id=user_id, following_user_id=author_id)
+            for user_id in new_users
+            for author_id in self.sample(user_ids,
+                                         options['follows_per_user'])
+            if author_id != user_id
+        ), ignore_conflicts=True)
+        for through, size in (
+                (User.favorite_list.through, options['favorites_per_user']),
+                (User.shopping_list.through, options['cart_per_user'])):
+            self.bulk_create(through, (
+                through(profile_id=user_id, recipe_id=recipe_id)
+                for user_id in new_users
+                for recipe_id in self.sample(recipe_ids, size)
+            ), ignore_conflicts=True)
+        updated = Recipe.objects.filter(
+            id__gt=last_recipe).reconcile_counters()
+        self.stdout.write(
+            f'Generated {len(new_users)} users and {updated} recipes')
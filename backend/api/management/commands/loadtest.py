@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+from statistics import mean
+from time import perf_counter
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands.benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = """Send concurrent GET requests to a running server and report
+            throughput and latency, e.g. to compare gunicorn settings"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--token', help='Authtoken key to send')
+
+    def fetch(self, request):
+        start = perf_counter()
+        try:
+            with urlopen(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+        except URLError as error:
+            raise CommandError(f'Request failed: {error.reason}')
+        return perf_counter() - start, status
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        request = Request(options['url'], headers=headers)
+        start = perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            results = list(executor.map(
+                self.fetch, [request] * options['requests']))
+        elapsed = perf_counter() - start
+        timings = sorted(timing * 1000 for timing, _ in results)
+        errors = sum(status != 200 for _, status in results)
+        self.stdout.write(
+            f'{len(results)} requests, {errors} errors in {elapsed:.2f} s: '
+            f'{len(results) / elapsed:.1f} req/s, '
+            f'p50 {percentile(timings, 50):.1f} ms, '
+            f'p99 {percentile(timings, 99):.1f} ms, '
+            f'mean {mean(timings):.1f} ms')
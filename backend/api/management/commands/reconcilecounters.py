@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Recipe
+
+
+class Command(BaseCommand):
+    help = """Recount favorites_count and in_carts_count of recipes
+            from the favorite and shopping lists"""
+
+    def handle(self, *args, **options):
+        updated = Recipe.objects.all().reconcile_counters()
+        self.stdout.write(f'Counters reconciled for {updated} recipes')
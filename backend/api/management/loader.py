@@ -0,0 +1,168 @@
+import csv
+import json
+from collections import Counter
+from functools import reduce
+from itertools import islice
+from operator import or_
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Yield the items of a top-level JSON array without reading it whole."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Expected a JSON array')
+    buffer, eof = buffer[1:], False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            end = None
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError('Unexpected end of JSON data')
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+class LoadCommand(BaseCommand):
+    """Base for commands that upsert reference data from a file.
+
+    Accepts csv with `fields` as columns, a JSON array of objects, and the
+    `dumpdata` format. Rows are read as a stream and written in batches: new
+    rows are inserted, rows that differ in `update_fields` are updated on
+    the `unique_fields` conflict, the rest are skipped.
+    """
+    model = None
+    fields = ()
+    unique_fields = ()
+    update_fields = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def read_rows(self, file, suffix):
+        if suffix == '.json':
+            label = self.model._meta.label_lower
+            for item in iter_json_array(file):
+                if 'model' in item:
+                    if item['model'] != label:
+                        continue
+                    item = item['fields']
+                yield {field: item[field] for field in self.fields}
+        else:
+            for row in csv.reader(file):
+                if row:
+                    yield dict(zip(self.fields, row))
+
+    def get_key(self, row):
+        return tuple(row[field] for field in self.unique_fields)
+
+    def get_lookup(self, keys):
+        return reduce(or_, (
+            Q(**dict(zip(self.unique_fields, key))) for key in keys
+        ))
+
+    def get_conflict(self, row):
+        """Name the unique value of `row` already held by another row."""
+        others = self.model.objects.exclude(
+            **dict(zip(self.unique_fields, self.get_key(row))))
+        for field in self.model._meta.fields:
+            if field.unique and field.name in row and others.filter(
+                    **{field.name: row[field.name]}).exists():
+                return f'{field.name}={row[field.name]!r}'
+        return None
+
+    def upsert(self, batch):
+        """Write a batch and count rows inserted, updated and skipped.
+
+        New rows that clash with another row on a unique field other than
+        `unique_fields` are skipped by the insert and reported; an update
+        clashing that way fails the command.
+        """
+        rows = {self.get_key(row): row for row in batch}
+        existing = {
+            self.get_key(values): values
+            for values in self.model.objects.filter(
+                self.get_lookup(rows)).values(*self.fields)
+        }
+        new = [key for key in rows if key not in existing]
+        changed = [
+            self.model(**row) for key, row in rows.items()
+            if key in existing and any(
+                existing[key][field] != row[field]
+                for field in self.update_fields
+            )
+        ]
+        inserted = 0
+        if new:
+            self.model.objects.bulk_create(
+                [self.model(**rows[key]) for key in new],
+                ignore_conflicts=True,
+            )
+            written = {
+                self.get_key(values)
+                for values in self.model.objects.filter(
+                    self.get_lookup(new)).values(*self.unique_fields)
+            }
+            inserted = len(written)
+            for key in new:
+                if key not in written:
+                    self.stderr.write(
+                        f'Skipped {rows[key]}: '
+                        f'{self.get_conflict(rows[key])} already exists')
+        if changed:
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(
+                        changed,
+                        update_conflicts=True,
+                        unique_fields=self.unique_fields,
+                        update_fields=self.update_fields,
+                    )
+            except IntegrityError as error:
+                for instance in changed:
+                    row = {field: getattr(instance, field)
+                           for field in self.fields}
+                    conflict = self.get_conflict(row)
+                    if conflict is not None:
+                        raise CommandError(
+                            f'Cannot update {row}: {conflict} already exists')
+                raise CommandError(f'Cannot update rows: {error}')
+        return {
+            'inserted': inserted,
+            'updated': len(changed),
+            'skipped': len(batch) - inserted - len(changed),
+        }
+
+    def handle(self, *args, **options):
+        data_file = Path(options['path'])
+        counts = Counter(inserted=0, updated=0, skipped=0)
+        try:
+            with data_file.open('r', encoding='utf-8') as file:
+                rows = self.read_rows(file, data_file.suffix)
+                while batch := list(islice(rows, options['batch_size'])):
+                    counts.update(self.upsert(batch))
+        except FileNotFoundError:
+            raise CommandError('File not found')
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f'Invalid data: {error}')
+        self.stdout.write(
+            'Data loaded successfully: {inserted} inserted, '
+            '{updated} updated, {skipped} skipped'.format(**counts)
+        )
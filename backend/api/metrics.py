@@ -0,0 +1,90 @@
+import json
+import logging
+from collections import Counter
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+
+class RequestStats:
+    """SQL statements of one request, collected by an execute wrapper."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += monotonic() - start
+            self.queries[sql] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.queries.most_common()
+                if count >= threshold]
+
+
+class Metrics:
+    """Per view action histograms of request time, kept in process."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.views = {}
+        self.flushed_at = monotonic()
+
+    def record(self, label, total, db_time, query_count, size):
+        bucket = next(i for i, bound in enumerate(BUCKETS)
+                      if total * 1000 <= bound)
+        with self.lock:
+            view = self.views.setdefault(label, {
+                'requests': 0,
+                'total_ms': 0.0,
+                'db_ms': 0.0,
+                'queries': 0,
+                'max_queries': 0,
+                'bytes': 0,
+                'histogram': [0] * len(BUCKETS),
+            })
+            view['requests'] += 1
+            view['total_ms'] += total * 1000
+            view['db_ms'] += db_time * 1000
+            view['queries'] += query_count
+            view['max_queries'] = max(view['max_queries'], query_count)
+            view['bytes'] += size or 0
+            view['histogram'][bucket] += 1
+        self.flush_if_due()
+
+    def snapshot(self):
+        with self.lock:
+            views = {label: {**view, 'histogram': list(view['histogram'])}
+                     for label, view in self.views.items()}
+        return {
+            'buckets_ms': [str(bound) for bound in BUCKETS],
+            'views': views,
+        }
+
+    def flush_if_due(self):
+        path = settings.API_METRICS_FILE
+        if not path or (monotonic() - self.flushed_at
+                        < settings.API_METRICS_FLUSH_INTERVAL):
+            return
+        self.flushed_at = monotonic()
+        try:
+            with open(path, 'w') as file:
+                json.dump(self.snapshot(), file, indent=2)
+        except OSError:
+            logger.exception('Could not write API metrics to %s', path)
+
+
+metrics = Metrics()
@@ -0,0 +1,83 @@
+import logging
+from contextlib import ExitStack
+from time import monotonic
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from api.metrics import RequestStats, metrics
+
+logger = logging.getLogger(__name__)
+
+
+def get_view_label(view_func, method):
+    """`ViewSet.action` for DRF views, the view name otherwise."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+
+
+class RequestMetricsMiddleware:
+    """Record SQL query count, DB, app and render time and response size.
+
+    The numbers are aggregated per view action in `api.metrics.metrics` and,
+    for staff users or with `DEBUG`, sent back in a `Server-Timing` header.
+    Streaming responses get no header, as their body is sent after the
+    middleware returns and isn't measured. Statements repeated at least
+    `API_DUPLICATE_QUERY_THRESHOLD` times in one request are logged as a
+    likely N+1 pattern.
+    """
+
+    def __init__(self, get_response):
+        if not settings.API_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        request.metrics = {'label': None, 'render': 0.0}
+        start = monotonic()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        total = monotonic() - start
+        label = request.metrics['label']
+        if label is None:
+            return response
+        if not response.streaming and self.shows_timing(request):
+            render = request.metrics['render']
+            app = max(total - stats.db_time - render, 0)
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={stats.db_time * 1000:.1f};'
+                f'desc="{stats.query_count} queries"',
+                f'app;dur={app * 1000:.1f};desc="view and serializers"',
+                f'render;dur={render * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ))
+        size = None if response.streaming else len(response.content)
+        metrics.record(label, total, stats.db_time, stats.query_count, size)
+        for sql, count in stats.duplicates(
+                settings.API_DUPLICATE_QUERY_THRESHOLD):
+            logger.warning('%s ran a statement %d times: %s',
+                           label, count, sql)
+        return response
+
+    def shows_timing(self, request):
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or getattr(user, 'is_staff', False)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics['label'] = get_view_label(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        start = monotonic()
+
+        def record_render(response):
+            request.metrics['render'] = monotonic() - start
+
+        response.add_post_render_callback(record_render)
+        return response
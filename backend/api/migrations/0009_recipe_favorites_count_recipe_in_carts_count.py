@@ -0,0 +1,41 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:44
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(through):
+    rows = through.objects.filter(recipe=OuterRef('pk')).values(
+        'recipe').annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(rows), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Profile = apps.get_model('api', 'Profile')
+    Recipe = apps.get_model('api', 'Recipe')
+    Recipe.objects.update(
+        favorites_count=count_subquery(Profile.favorite_list.through),
+        in_carts_count=count_subquery(Profile.shopping_list.through),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_recipe_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
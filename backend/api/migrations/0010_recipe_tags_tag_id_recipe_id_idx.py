@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_recipe_favorites_count_recipe_in_carts_count'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX recipe_tags_tag_recipe_idx '
+            'ON api_recipe_tags (tag_id, recipe_id);',
+            'DROP INDEX recipe_tags_tag_recipe_idx;',
+        ),
+    ]
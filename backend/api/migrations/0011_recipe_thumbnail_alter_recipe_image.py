@@ -0,0 +1,25 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:47
+
+import api.models
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_recipe_tags_tag_id_recipe_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, storage=api.storage.ContentHashStorage(), upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(storage=api.storage.ContentHashStorage(), upload_to=api.models.user_directory_path),
+        ),
+    ]
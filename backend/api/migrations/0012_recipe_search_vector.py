@@ -0,0 +1,47 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:55
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+from api.operations import AddPostgresIndex
+
+
+def fill_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    IngredientAmount = apps.get_model('api', 'IngredientAmount')
+    Recipe = apps.get_model('api', 'Recipe')
+    config = settings.RECIPE_SEARCH_CONFIG
+    names = IngredientAmount.objects.filter(recipe=OuterRef('pk')).values(
+        'recipe').annotate(names=StringAgg('ingredient__name', ' ')).values(
+        'names')
+    Recipe.objects.update(search_vector=(
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(Subquery(names), weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_recipe_thumbnail_alter_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        AddPostgresIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+        ),
+    ]
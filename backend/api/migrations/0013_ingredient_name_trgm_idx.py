@@ -0,0 +1,22 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:57
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+from api.operations import AddPostgresIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_recipe_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddPostgresIndex(
+            model_name='ingredient',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='ingredient_name_trgm_idx', opclasses=('gin_trgm_ops',)),
+        ),
+    ]
@@ -1,7 +1,17 @@
-from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
+from django.db import connections, models
+from django.db.models import (Count, Exists, F, OuterRef, Q, Subquery,
+                              Value)
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 
+from api.storage import ContentHashStorage
+
 
 def user_directory_path(instance, filename):
     return "user_{0}/{1}".format(instance.author.id, filename)
@@ -78,7 +88,9 @@ class Ingredient(models.Model):
     class Meta:
         ordering = ("name", )
         indexes = [
-            models.Index(fields=("name", ), name="ingredient_name_idx")
+            models.Index(fields=("name", ), name="ingredient_name_idx"),
+            GinIndex(fields=("name", ), name="ingredient_name_trgm_idx",
+                     opclasses=("gin_trgm_ops", )),
         ]
         constraints = [
             models.UniqueConstraint(fields=("name", "measurement_unit"),
@@ -92,6 +104,95 @@ class Ingredient(models.Model):
         return reverse("ingredients", kwargs={"pk": self.pk})
 
 
+def count_subquery(through):
+    rows = through.objects.filter(recipe=OuterRef('pk')).values(
+        'recipe').annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(rows), 0)
+
+
+def recipe_search_vector():
+    """Weighted document of a recipe: name, ingredient names, then text."""
+    config = settings.RECIPE_SEARCH_CONFIG
+    names = IngredientAmount.objects.filter(recipe=OuterRef('pk')).values(
+        'recipe').annotate(names=StringAgg('ingredient__name', ' ')).values(
+        'names')
+    return (SearchVector('name', weight='A', config=config)
+            + SearchVector(Subquery(names), weight='B', config=config)
+            + SearchVector('text', weight='C', config=config))
+
+
+class RecipeQuerySet(models.QuerySet):
+    @staticmethod
+    def in_list_of(through, user):
+        return Exists(through.objects.filter(profile=user,
+                                             recipe=OuterRef('pk')))
+
+    def annotate_user_flags(self, user):
+        """Compute is_favorited / is_in_shopping_cart in the main query."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return self.annotate(
+            is_favorited=self.in_list_of(Profile.favorite_list.through,
+                                         user),
+            is_in_shopping_cart=self.in_list_of(
+                Profile.shopping_list.through, user),
+        )
+
+    def favorited_by(self, user):
+        return self.filter(
+            self.in_list_of(Profile.favorite_list.through, user))
+
+    def in_cart_of(self, user):
+        return self.filter(
+            self.in_list_of(Profile.shopping_list.through, user))
+
+    def followed_by(self, user):
+        """Recipes of the authors `user` is subscribed to."""
+        return self.filter(Exists(UserFollowing.objects.filter(
+            user=user, following_user=OuterRef('author'))))
+
+    def with_tags(self, tag_ids):
+        return self.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids)))
+
+    def increment(self, field, delta=1):
+        return self.update(**{field: F(field) + delta})
+
+    def search(self, query):
+        """Full-text search over name, text and ingredient names.
+
+        On PostgreSQL matches go through the GIN-indexed `search_vector` and
+        are ordered by rank. Other backends, e.g. SQLite in tests, fall back
+        to a plain substring match in the default order.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            ingredients = IngredientAmount.objects.filter(
+                recipe=OuterRef('pk'), ingredient__name__icontains=query)
+            return self.filter(Q(name__icontains=query)
+                               | Q(text__icontains=query)
+                               | Exists(ingredients))
+        search_query = SearchQuery(query, search_type='websearch',
+                                   config=settings.RECIPE_SEARCH_CONFIG)
+        return self.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query),
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    def update_search_vector(self):
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=recipe_search_vector())
+
+    def reconcile_counters(self):
+        """Recount favorites_count and in_carts_count from the M2M tables."""
+        return self.update(
+            favorites_count=count_subquery(Profile.favorite_list.through),
+            in_carts_count=count_subquery(Profile.shopping_list.through),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         Profile,
@@ -103,6 +204,12 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to=user_directory_path,
+        storage=ContentHashStorage(),
+    )
+    thumbnail = models.ImageField(
+        blank=True,
+        editable=False,
+        storage=ContentHashStorage(),
     )
     text = models.TextField()
     ingredients = models.ManyToManyField(
@@ -112,9 +219,22 @@ class Recipe(models.Model):
     tags = models.ManyToManyField(Tag)
     cooking_time = models.IntegerField()
     pub_date = models.DateTimeField(auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(default=0)
+    in_carts_count = models.PositiveIntegerField(default=0)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ("-pub_date", )
+        indexes = [
+            models.Index(fields=("-pub_date", "-id"),
+                         name="recipe_pub_date_id_idx"),
+            models.Index(fields=("author", "-pub_date"),
+                         name="recipe_author_pub_date_idx"),
+            GinIndex(fields=("search_vector", ),
+                     name="recipe_search_vector_idx"),
+        ]
 
     def __str__(self):
         return f'{self.name}: Автор: {self.author.username}'
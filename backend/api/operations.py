@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    """AddIndex for PostgreSQL-only index types.
+
+    The index is part of the model state everywhere, but is only created on
+    PostgreSQL, so migrations still apply to SQLite used in tests.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state,
+                                      to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state,
+                                       to_state)
@@ -1,6 +1,84 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
     page_query_param = 'page'
     page_size_query_param = 'limit'
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over (pub_date, id) of recipes.
+
+    Each page is fetched with `WHERE (pub_date, id) < cursor` served by
+    `recipe_pub_date_id_idx`, so deep pages cost the same as the first one
+    and no `COUNT(*)` is run. The OR of the row comparison isn't sargable,
+    so it is paired with a plain `pub_date <= cursor` range condition.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            pub_date, pk = cursor
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk),
+                pub_date__lte=pub_date,
+            )
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        self.page = page[:page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def encode_cursor(self, instance):
+        value = f'{instance.pub_date.isoformat()} {instance.pk}'
+        return urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            pub_date, pk = value.split(' ')
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
@@ -0,0 +1,187 @@
+import csv
+from itertools import chain, islice
+
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer that encodes with orjson when it is installed.
+
+    Indented output, e.g. in the browsable API, and installs without orjson
+    use the stock encoder. Types orjson doesn't know, dates included, are
+    passed to DRF's encoder so the output stays the same. Non-string keys,
+    e.g. item indexes in ListField errors, are converted like json does.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(
+                accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return orjson.dumps(data, default=self.encoder_class().default,
+                            option=(orjson.OPT_PASSTHROUGH_DATETIME
+                                    | orjson.OPT_NON_STR_KEYS))
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """Base class for shopping list exports.
+
+    Exports are streamed with `stream`, which takes an iterator of rows with
+    `name`, `measurement_unit` and `total_amount` keys. `render` is only used
+    for responses built by DRF itself, e.g. authentication errors.
+    """
+    charset = 'utf-8'
+    title = 'Your shopping list'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            lines = (f'{key}: {value}' for key, value in data.items())
+        else:
+            lines = (str(data), )
+        return b''.join(self.stream_lines(lines))
+
+    def stream(self, rows):
+        lines = (
+            f'{i}. {row["name"]}: {row["total_amount"]} '
+            f'{row["measurement_unit"]}'
+            for i, row in enumerate(rows, 1)
+        )
+        return self.stream_lines(chain((self.title, ''), lines))
+
+    def stream_lines(self, lines):
+        raise NotImplementedError(
+            'ShoppingListRenderer.stream_lines() must be implemented.')
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream_lines(self, lines):
+        for line in lines:
+            yield f'{line}\n'.encode(self.charset)
+
+
+class Echo:
+    """File-like object that returns what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('name', 'amount', 'measurement_unit')
+
+    def stream(self, rows):
+        rows = (
+            (row['name'], row['total_amount'], row['measurement_unit'])
+            for row in rows
+        )
+        return self.stream_rows(chain((self.header, ), rows))
+
+    def stream_lines(self, lines):
+        return self.stream_rows((line, ) for line in lines)
+
+    def stream_rows(self, rows):
+        writer = csv.writer(Echo())
+        for row in rows:
+            yield writer.writerow(row).encode(self.charset)
+
+
+def cyrillic_glyphs(first, last, skip):
+    return [f'/afii{code}' for code in range(first, last + 1) if code != skip]
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """Minimal PDF writer that emits one page at a time.
+
+    Text is set in the built-in Helvetica font with a cp1251 based encoding,
+    so no font files are embedded and Cyrillic names stay readable.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+    encoding = 'cp1251'
+    page_size = (595, 842)
+    margin = 40
+    font_size = 12
+    leading = 15
+    lines_per_page = 50
+    font = (
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+        '/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+        '/Differences [168 /afii10023 184 /afii10071 192 '
+        + ' '.join(cyrillic_glyphs(10017, 10049, skip=10023)
+                   + cyrillic_glyphs(10065, 10097, skip=10071))
+        + '] >> >>'
+    ).encode()
+
+    def encode_line(self, line):
+        text = line.encode(self.encoding, errors='replace')
+        for char in (b'\\', b'(', b')'):
+            text = text.replace(char, b'\\' + char)
+        return b'(' + text + b') Tj T*'
+
+    def page_content(self, lines):
+        height = self.page_size[1]
+        return b'\n'.join(chain(
+            (b'BT /F1 %d Tf %d TL %d %d Td' % (
+                self.font_size, self.leading, self.margin,
+                height - self.margin),),
+            (self.encode_line(line) for line in lines),
+            (b'ET', ),
+        ))
+
+    def stream_lines(self, lines):
+        offsets = {}
+        position = 0
+
+        def write(number, body):
+            nonlocal position
+            data = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+            offsets[number] = position
+            position += len(data)
+            return data
+
+        header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        position += len(header)
+        yield header
+        yield write(3, self.font)
+
+        kids = []
+        number = 4
+        lines = iter(lines)
+        while True:
+            page = list(islice(lines, self.lines_per_page))
+            if not page and kids:
+                break
+            content = self.page_content(page)
+            yield write(number, b'<< /Length %d >>\nstream\n%s\nendstream' % (
+                len(content), content))
+            yield write(number + 1, (
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                b'/Resources << /Font << /F1 3 0 R >> >> '
+                b'/Contents %d 0 R >>' % (*self.page_size, number)
+            ))
+            kids.append(b'%d 0 R' % (number + 1))
+            number += 2
+
+        yield write(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(kids), len(kids)))
+        yield write(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+        xref = [b'xref\n0 %d\n0000000000 65535 f \n' % number]
+        xref.extend(b'%010d 00000 n \n' % offsets[i] for i in range(1, number))
+        yield b''.join(xref)
+        yield (
+            b'trailer\n<< /Size %d /Root 1 0 R >>\n'
+            b'startxref\n%d\n%%%%EOF\n' % (number, position)
+        )
@@ -0,0 +1,75 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+read_alias = ContextVar('read_alias', default=None)
+
+
+@contextmanager
+def primary():
+    """Send reads inside the block to the primary database."""
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def get_pin_key(user):
+    return f'replica-pin:{user.pk}'
+
+
+def pin_to_primary(user):
+    cache.set(get_pin_key(user), True, settings.REPLICA_PIN_TIMEOUT)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(get_pin_key(user), False)
+
+
+class ReplicaRouter:
+    """Route reads to the replica chosen for the current request.
+
+    Outside of `ReplicaReadMixin` views every query goes to `default`.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {'default', *settings.DATABASE_REPLICAS}
+        if {obj1._state.db, obj2._state.db} <= aliases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """Serve GET and HEAD requests of a viewset from a read replica.
+
+    Authentication runs on the primary. A write pins its user to the primary
+    for `REPLICA_PIN_TIMEOUT` seconds so they read their own writes; pins
+    live in the default cache, which has to be shared between workers.
+    """
+    replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD'):
+            if request.user.is_authenticated:
+                pin_to_primary(request.user)
+        elif settings.DATABASE_REPLICAS and not is_pinned(request.user):
+            self.replica_token = read_alias.set(
+                random.choice(settings.DATABASE_REPLICAS))
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.replica_token is not None:
+                read_alias.reset(self.replica_token)
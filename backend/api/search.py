@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from difflib import SequenceMatcher
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, transaction
+
+from api.replicas import primary
+
+
+class IngredientIndex:
+    """Process-local autocomplete index over ingredient names.
+
+    Keeps casefolded names in a sorted list next to the serialized
+    ingredients, so prefix lookups are a bisect and never touch the database.
+    The index is dropped by `invalidate` once a change to ingredients in this
+    process commits and rebuilt after `ttl` seconds to pick up changes made
+    by other workers.
+
+    Fuzzy matches come from `pg_trgm` on PostgreSQL and from `difflib` over
+    the in-memory names elsewhere.
+    """
+    fuzzy_cutoff = 0.6
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.data = None
+        self.built_at = 0
+
+    def invalidate(self):
+        self.data = None
+
+    def build(self):
+        from api.models import Ingredient
+        from api.serializers import IngredientSerializer
+
+        queryset = Ingredient.objects.order_by('name', 'measurement_unit')
+        with primary():
+            items = IngredientSerializer(queryset, many=True).data
+        entries = sorted(
+            ((item['name'].casefold(), index, item)
+             for index, item in enumerate(items)),
+            key=lambda entry: entry[:2],
+        )
+        keys = [key for key, _, _ in entries]
+        items = [item for _, _, item in entries]
+        return keys, items
+
+    def load(self):
+        ttl = settings.INGREDIENT_INDEX_TTL if self.ttl is None else self.ttl
+        data = self.data
+        if data is None or monotonic() - self.built_at > ttl:
+            with self.lock:
+                if self.data is data:
+                    self.data = self.build()
+                    self.built_at = monotonic()
+                data = self.data
+        return data
+
+    def similar(self, query, limit):
+        """Ingredients with names similar to `query`, most similar first."""
+        from api.models import Ingredient
+        from api.serializers import IngredientSerializer
+
+        if connection.vendor == 'postgresql':
+            queryset = Ingredient.objects.filter(
+                name__trigram_similar=query,
+            ).annotate(
+                similarity=TrigramSimilarity('name', query),
+            ).order_by('-similarity', 'name')[:limit]
+            return IngredientSerializer(queryset, many=True).data
+        keys, items = self.load()
+        matcher = SequenceMatcher(b=query)
+        scored = []
+        for index, key in enumerate(keys):
+            matcher.set_seq1(key)
+            if matcher.quick_ratio() < self.fuzzy_cutoff:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= self.fuzzy_cutoff:
+                scored.append((-ratio, index))
+        return [items[index] for _, index in sorted(scored)[:limit]]
+
+    def search(self, query, limit=None, fuzzy=False):
+        """Ingredients starting with `query`, then those containing it.
+
+        With `fuzzy` the rest is filled with up to `INGREDIENT_FUZZY_LIMIT`
+        similar names that were not matched already.
+        """
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        query = query.strip().casefold()
+        keys, items = self.load()
+        result = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(query)):
+            result.append(items[position])
+            position += 1
+        if len(result) < limit:
+            for key, item in zip(keys, items):
+                if query in key and not key.startswith(query):
+                    result.append(item)
+                    if len(result) >= limit:
+                        break
+        if fuzzy and len(result) < limit:
+            found = {item['id'] for item in result}
+            similar = self.similar(query, settings.INGREDIENT_FUZZY_LIMIT)
+            result.extend(
+                item for item in similar if item['id'] not in found
+            )
+        return result[:limit]
+
+
+ingredient_index = IngredientIndex()
+
+
+def update_search_vectors(pks):
+    """Recompute recipe search vectors once the transaction commits.
+
+    Deferred to commit so that ingredients written after the recipe itself,
+    e.g. by `RecipeSerializer.create`, are part of the vector.
+    """
+    from api.models import Recipe
+
+    pks = list(pks)
+    if pks:
+        transaction.on_commit(lambda: Recipe.objects.filter(
+            pk__in=pks).update_search_vector())
@@ -1,19 +1,68 @@
 from django.contrib.auth import get_user_model
 
-from django.db.models import F
-from django.shortcuts import get_object_or_404
+from django.db import transaction
 from djoser.conf import settings
 from djoser.serializers import UserSerializer, UserCreateSerializer
 from rest_framework import serializers, validators
+from rest_framework.permissions import SAFE_METHODS
 
 from api import models
 from api.fields import ImageFieldSerialiser
+from api.images import get_thumbnail_name
 
 
 User = get_user_model()
 
 
-class ProfileSerializer(UserSerializer):
+def get_following_ids(context):
+    """Ids of authors followed by the requesting user.
+
+    Loaded once and stored in the root serializer context, so nested and
+    list serializers of one request share a single query.
+    """
+    if 'following_ids' not in context:
+        user = context.get('request').user
+        context['following_ids'] = set(
+            user.following.values_list('following_user_id', flat=True)
+        ) if user.is_authenticated else set()
+    return context['following_ids']
+
+
+def get_sparse_fields(request, fields):
+    """Names in `fields` selected by the `fields` and `omit` parameters.
+
+    Both take comma-separated field names and only apply to safe requests.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return tuple(fields)
+    params = request.query_params
+    if 'fields' in params:
+        selected = set(params['fields'].split(','))
+        fields = [name for name in fields if name in selected]
+    if 'omit' in params:
+        omitted = set(params['omit'].split(','))
+        fields = [name for name in fields if name not in omitted]
+    return tuple(fields)
+
+
+class SparseFieldsetMixin:
+    """Serialize only the fields picked by `get_sparse_fields`.
+
+    Applies to the top-level serializer of a response, nested serializers
+    keep all their fields.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if parent is None or (isinstance(parent, serializers.ListSerializer)
+                              and parent.parent is None):
+            names = get_sparse_fields(self.context.get('request'), fields)
+            fields = {name: fields[name] for name in names}
+        return fields
+
+
+class ProfileSerializer(SparseFieldsetMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -22,11 +71,7 @@ class ProfileSerializer(UserSerializer):
                   'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and user.following.filter(following_user=obj).exists()
-        )
+        return obj.id in get_following_ids(self.context)
 
 
 class ProfileCreateSerializer(UserCreateSerializer):
@@ -50,14 +95,17 @@ class SubscriptionsSerializer(ProfileSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        limit = self.context.get('recipes_limit', settings.LIMIT_RECIPES)
-        recipes = obj.recipes.all()[:int(limit)]
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            limit = self.context.get('recipes_limit', settings.LIMIT_RECIPES)
+            recipes = obj.recipes.all()[:int(limit)]
         serializer = RecipeSimpleSerializer(recipes, many=True)
         return serializer.data
 
     def get_recipes_count(self, obj):
-        count = obj.recipes.all().count()
-        return count
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.recipes.count()
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -87,14 +135,43 @@ class SubscribeSerializer(serializers.ModelSerializer):
                                        context=self.context,).data
 
 
+class InBulkListSerializer(serializers.ListSerializer):
+    """Resolves the ids of all list items with a single in_bulk query.
+
+    The child serializer provides `get_pk(item)` and
+    `from_instance(instance, item)`.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise validators.ValidationError('Expected a list of items')
+        if not self.allow_empty and not data:
+            raise validators.ValidationError('This list may not be empty')
+        try:
+            pks = [int(self.child.get_pk(item)) for item in data]
+        except (KeyError, TypeError, ValueError):
+            raise validators.ValidationError('Invalid id')
+        instances = self.child.Meta.model.objects.in_bulk(pks)
+        missing = sorted(set(pks) - instances.keys())
+        if missing:
+            raise validators.ValidationError(f'Objects not found: {missing}')
+        return [
+            self.child.from_instance(instances[pk], item)
+            for pk, item in zip(pks, data)
+        ]
+
+
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Tag
         fields = ('id', 'name', 'color', 'slug')
+        list_serializer_class = InBulkListSerializer
 
-    def to_internal_value(self, data):
-        tag = get_object_or_404(models.Tag, id=data)
-        return tag
+    def get_pk(self, data):
+        return data
+
+    def from_instance(self, instance, data):
+        return instance
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -112,12 +189,25 @@ class IngredientAmountSerializer(IngredientSerializer):
     class Meta:
         model = models.Ingredient
         fields = ('id', 'name', 'measurement_unit', 'amount')
+        list_serializer_class = InBulkListSerializer
+
+    def get_pk(self, data):
+        return data['id']
+
+    def from_instance(self, instance, data):
+        amount = self.fields['amount'].run_validation(data.get('amount'))
+        return {'ingredient': instance, 'amount': amount}
 
-    def to_internal_value(self, data):
-        ing_id = data.pop('id')
-        ingredient = get_object_or_404(models.Ingredient, id=ing_id)
-        data['ingredient'] = ingredient
-        return data
+
+class RecipeIngredientSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='ingredient.id', read_only=True)
+    name = serializers.CharField(source='ingredient.name', read_only=True)
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit', read_only=True)
+
+    class Meta:
+        model = models.IngredientAmount
+        fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
 class RecipeSimpleSerializer(serializers.ModelSerializer):
@@ -128,8 +218,20 @@ class RecipeSimpleSerializer(serializers.ModelSerializer):
         model = models.Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
+    def use_thumbnail(self):
+        return True
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.use_thumbnail() and 'image' in data and instance.image and (
+                instance.thumbnail.name
+                == get_thumbnail_name(instance.image.name)):
+            data['image'] = self.fields['image'].to_representation(
+                instance.thumbnail)
+        return data
+
 
-class RecipeSerializer(RecipeSimpleSerializer):
+class RecipeSerializer(SparseFieldsetMixin, RecipeSimpleSerializer):
     author = ProfileSerializer(read_only=True)
     tags = TagSerializer(many=True)
     ingredients = serializers.SerializerMethodField()
@@ -141,13 +243,21 @@ class RecipeSerializer(RecipeSimpleSerializer):
         fields = ('id', 'name', 'image', 'cooking_time', 'author', 'text',
                   'tags', 'ingredients', 'is_favorited', 'is_in_shopping_cart')
 
+    def use_thumbnail(self):
+        view = self.context.get('view')
+        return view is not None and view.action in ('list', 'feed')
+
     def get_ingredients(self, obj):
-        ingredients = obj.ingredients.annotate(
-            amount=F('ingredientamount__amount'))
-        serializer = IngredientAmountSerializer(ingredients, many=True)
+        amounts = getattr(obj, 'ingredient_amounts', None)
+        if amounts is None:
+            amounts = obj.ingredientamount_set.select_related(
+                'ingredient').order_by('ingredient__name')
+        serializer = RecipeIngredientSerializer(amounts, many=True)
         return serializer.data
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -155,6 +265,8 @@ class RecipeSerializer(RecipeSimpleSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -164,8 +276,15 @@ class RecipeSerializer(RecipeSimpleSerializer):
     def validate_ingredients(self, value):
         serializer = IngredientAmountSerializer(data=value, many=True)
         serializer.is_valid(raise_exception=True)
-        return serializer.validated_data
+        ingredients = serializer.validated_data
+        if len({data['ingredient'].id for data in ingredients}) != len(
+                ingredients):
+            raise validators.ValidationError(
+                'Ingredients must not be repeated'
+            )
+        return ingredients
 
+    @transaction.atomic
     def create(self, validate_data):
         initial_ingred = self.initial_data.get('ingredients')
         ingredients = self.validate_ingredients(initial_ingred)
@@ -175,50 +294,66 @@ class RecipeSerializer(RecipeSimpleSerializer):
             author=author, **validate_data
         )
         instance.tags.add(*tags)
-        for data in ingredients:
-            ingredient = data.get('ingredient')
-            amount = data.get('amount')
-            instance.ingredients.add(
-                ingredient, through_defaults={"amount": amount})
+        models.IngredientAmount.objects.bulk_create(
+            models.IngredientAmount(recipe=instance, **data)
+            for data in ingredients
+        )
         return instance
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.name = validated_data.pop('name', instance.name)
         instance.image = validated_data.pop('image', instance.image)
         instance.cooking_time = validated_data.pop('cooking_time',
                                                    instance.cooking_time)
         instance.text = validated_data.pop('text', instance.text)
-        tags = validated_data.get('tags', [])
-        instance.tags.set(tags)
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data['tags'])
         if 'ingredients' in self.initial_data:
             ingredients = self.validate_ingredients(
                 self.initial_data.get('ingredients')
             )
-            ingr = []
-            for data in ingredients:
-                ingredient = data.get('ingredient')
-                ingr.append(ingredient)
-                amount = data.get('amount')
-                models.IngredientAmount.objects.update_or_create(
-                    ingredient=ingredient,
-                    recipe=instance,
-                    amount=amount
-                )
-            instance.ingredients.set(ingr)
+            self.update_ingredients(instance, ingredients)
         instance.save()
         return instance
 
+    def update_ingredients(self, instance, ingredients):
+        """Apply the new ingredient list as a diff of through rows."""
+        existing = {
+            row.ingredient_id: row
+            for row in instance.ingredientamount_set.all()
+        }
+        amounts = {data['ingredient'].id: data['amount']
+                   for data in ingredients}
+        removed = existing.keys() - amounts.keys()
+        if removed:
+            instance.ingredientamount_set.filter(
+                ingredient_id__in=removed).delete()
+        models.IngredientAmount.objects.bulk_create(
+            models.IngredientAmount(recipe=instance, ingredient_id=pk,
+                                    amount=amount)
+            for pk, amount in amounts.items() if pk not in existing
+        )
+        changed = []
+        for pk, row in existing.items():
+            if pk in amounts and row.amount != amounts[pk]:
+                row.amount = amounts[pk]
+                changed.append(row)
+        models.IngredientAmount.objects.bulk_update(changed, ['amount'])
+        # Rows prefetched by the view are stale after the diff.
+        vars(instance).pop('ingredient_amounts', None)
+
 
 class FavoriteShoppingCartSerializer(serializers.Serializer):
     def validate(self, attrs):
         recipe = self.context.get('recipe')
-        queryset = self.context.get('queryset').all()
+        listed = self.context.get('queryset').filter(pk=recipe.pk).exists()
         delete = self.context.get('delete')
-        if not delete and (recipe in queryset):
+        if not delete and listed:
             raise validators.ValidationError(
                 'The recipe is already in your favorites'
             )
-        if delete and (recipe not in queryset):
+        if delete and not listed:
             raise validators.ValidationError(
                 "The recipe isn't yet in your favorites"
             )
@@ -227,3 +362,11 @@ class FavoriteShoppingCartSerializer(serializers.Serializer):
     def to_representation(self, instance):
         recipe = self.context.get('recipe')
         return RecipeSimpleSerializer(recipe).data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
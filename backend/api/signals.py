@@ -0,0 +1,150 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+
+from api.caching import (invalidate_recipes, invalidate_reference_cache,
+                         invalidate_user_flags)
+from api.images import get_thumbnail_name, schedule_thumbnail
+from api.models import (Ingredient, IngredientAmount, Profile, Recipe, Tag,
+                        UserFollowing)
+from api.search import ingredient_index, update_search_vectors
+from api.utils import (invalidate_recipe_shopping_summaries,
+                       invalidate_shopping_summaries, update_shopping_summary)
+
+
+def get_forward_ids(sender, instance, action, reverse, model, pk_set):
+    """Ids of the objects on the forward side touched by m2m_changed."""
+    if not reverse:
+        return [instance.pk] if action.startswith('post_') else []
+    if action in ('post_add', 'post_remove'):
+        return list(pk_set)
+    if action == 'pre_clear':
+        return list(sender.objects.filter(
+            **{instance._meta.model_name: instance}
+        ).values_list(f'{model._meta.model_name}_id', flat=True))
+    return []
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_reference_data(sender, **kwargs):
+    invalidate_reference_cache(sender)
+
+
+@receiver(post_save, sender=Recipe)
+def update_thumbnail(sender, instance, **kwargs):
+    if not instance.image:
+        return
+    if instance.thumbnail.name != get_thumbnail_name(instance.image.name):
+        schedule_thumbnail(instance)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'name', 'text'} & update_fields:
+        update_search_vectors([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search(sender, instance, **kwargs):
+    update_search_vectors(IngredientAmount.objects.filter(
+        ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver([post_save, post_delete], sender=IngredientAmount)
+def invalidate_recipe_ingredients(sender, instance, **kwargs):
+    invalidate_recipes([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, model, pk_set,
+                           **kwargs):
+    invalidate_recipes(
+        get_forward_ids(sender, instance, action, reverse, model, pk_set))
+
+
+@receiver([post_save, pre_delete], sender=Tag)
+def invalidate_tag_recipes(sender, instance, **kwargs):
+    invalidate_recipes(Recipe.tags.through.objects.filter(
+        tag=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_ingredient_recipes(sender, instance, **kwargs):
+    invalidate_recipes(IngredientAmount.objects.filter(
+        ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_author_recipes(sender, instance, created, update_fields,
+                              **kwargs):
+    if created or update_fields == frozenset(('last_login', )):
+        return
+    invalidate_recipes(instance.recipes.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.delete([instance.key])
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_user_tokens(sender, instance, created, update_fields,
+                           **kwargs):
+    if created or update_fields == frozenset(('last_login', )):
+        return
+    token_cache.delete(
+        Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(m2m_changed, sender=Profile.favorite_list.through)
+@receiver(m2m_changed, sender=Profile.shopping_list.through)
+def invalidate_list_flags(sender, instance, action, reverse, model, pk_set,
+                          **kwargs):
+    invalidate_user_flags(
+        get_forward_ids(sender, instance, action, reverse, model, pk_set))
+
+
+@receiver([post_save, post_delete], sender=UserFollowing)
+def invalidate_subscription_flags(sender, instance, **kwargs):
+    invalidate_user_flags([instance.user_id])
+
+
+@receiver(m2m_changed, sender=Profile.shopping_list.through)
+def update_shopping_summaries(sender, instance, action, reverse, model,
+                              pk_set, **kwargs):
+    if not reverse and action in ('post_add', 'post_remove'):
+        changes = {'added' if action == 'post_add' else 'removed': pk_set}
+        transaction.on_commit(
+            lambda: update_shopping_summary(instance.pk, **changes))
+    else:
+        invalidate_shopping_summaries(
+            get_forward_ids(sender, instance, action, reverse, model,
+                            pk_set))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(pre_delete, sender=Recipe)
+def invalidate_recipe_summaries(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_recipe_shopping_summaries([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_ingredient_summaries(sender, instance, **kwargs):
+    invalidate_recipe_shopping_summaries(IngredientAmount.objects.filter(
+        ingredient=instance).values_list('recipe_id', flat=True))
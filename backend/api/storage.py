@@ -0,0 +1,20 @@
+import re
+from os.path import basename
+
+from django.core.files.storage import FileSystemStorage
+
+CONTENT_HASH_NAME = re.compile(r'^[0-9a-f]{64}\.\w+$')
+
+
+class ContentHashStorage(FileSystemStorage):
+    """File storage that keeps a single copy of content-addressed files.
+
+    Files named by the sha256 of their content are not written again when
+    they already exist, other names are saved as usual.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name and CONTENT_HASH_NAME.match(basename(name)) and self.exists(
+                name):
+            return name
+        return super().save(name, content, max_length)
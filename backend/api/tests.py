@@ -0,0 +1,1068 @@
+import base64
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from api import caching, models, renderers, utils, views
+from api.authentication import token_cache
+from api.checks import check_replica_pin_cache
+from api.fields import decode_base64
+from api.images import make_thumbnail
+from api.replicas import is_pinned, primary, read_alias
+from api.search import ingredient_index
+
+User = get_user_model()
+
+# Fixtures use an image file that doesn't exist, so tests running on-commit
+# callbacks must not send it to the thumbnail workers.
+skip_thumbnails = patch('api.signals.schedule_thumbnail', Mock())
+
+
+class RecipeListQueriesTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        recipes = models.Recipe.objects.bulk_create(
+            models.Recipe(author=author, name=f'Recipe {i}', image='r.png',
+                          text='text', cooking_time=10)
+            for i in range(10)
+        )
+        ingredients = models.Ingredient.objects.bulk_create(
+            models.Ingredient(name=f'Ingredient {i}', measurement_unit='г')
+            for i in range(3)
+        )
+        models.IngredientAmount.objects.bulk_create(
+            models.IngredientAmount(recipe=recipe, ingredient=ingredient,
+                                    amount=100)
+            for recipe in recipes for ingredient in ingredients
+        )
+        models.UserFollowing.objects.create(user=cls.user,
+                                            following_user=author)
+        cls.user.favorite_list.add(*recipes[::2])
+        cls.user.shopping_list.add(*recipes[1::2])
+
+    def setUp(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def count_queries(self, limit, *tables):
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return sum(
+            any(table in query['sql'] for table in tables)
+            for query in context.captured_queries
+        )
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.assertEqual(self.count_queries(2, ''),
+                         self.count_queries(10, ''))
+
+    def test_flag_queries_do_not_depend_on_page_size(self):
+        tables = ('api_profile_favorite_list', 'api_profile_shopping_list')
+        self.assertEqual(self.count_queries(2, *tables),
+                         self.count_queries(10, *tables))
+
+    def test_ingredient_queries_do_not_depend_on_page_size(self):
+        self.assertEqual(self.count_queries(2, 'api_ingredientamount'),
+                         self.count_queries(10, 'api_ingredientamount'))
+
+    def test_ingredients_are_rendered(self):
+        response = self.client.get('/api/recipes/', {'limit': 1})
+        self.assertEqual(
+            response.data['results'][0]['ingredients'][0].keys(),
+            {'id', 'name', 'measurement_unit', 'amount'},
+        )
+
+    def test_ingredients_are_ordered_by_name(self):
+        recipe = models.Recipe.objects.latest('pub_date', 'id')
+        ingredient = models.Ingredient.objects.create(
+            name='A ingredient', measurement_unit='г')
+        models.IngredientAmount.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=1)
+        expected = ['A ingredient'] + [f'Ingredient {i}' for i in range(3)]
+        for url in ('/api/recipes/', f'/api/recipes/{recipe.id}/'):
+            data = self.client.get(url, {'limit': 1}).data
+            recipe_data = data['results'][0] if 'results' in data else data
+            self.assertEqual(
+                [item['name'] for item in recipe_data['ingredients']],
+                expected)
+
+    def test_flags_are_annotated(self):
+        response = self.client.get('/api/recipes/', {'limit': 10})
+        favorited = {recipe.id for recipe in self.user.favorite_list.all()}
+        in_cart = {recipe.id for recipe in self.user.shopping_list.all()}
+        for recipe in response.data['results']:
+            self.assertEqual(recipe['is_favorited'],
+                             recipe['id'] in favorited)
+            self.assertEqual(recipe['is_in_shopping_cart'],
+                             recipe['id'] in in_cart)
+
+    def test_author_is_subscribed(self):
+        response = self.client.get('/api/recipes/', {'limit': 10})
+        for recipe in response.data['results']:
+            self.assertTrue(recipe['author']['is_subscribed'])
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, [query['sql'] for query in
+                               context.captured_queries]
+
+    def test_fields_skip_queries(self):
+        data, queries = self.get('/api/recipes/',
+                                 {'limit': 3, 'fields': 'id,name'})
+        self.assertEqual(set(data['results'][0]), {'id', 'name'})
+        for table in ('api_tag', 'api_ingredientamount',
+                      'api_profile_favorite_list', 'api_userfollowing'):
+            self.assertFalse(any(f'"{table}"' in sql for sql in queries),
+                             table)
+        self.assertFalse(any('"api_recipe"' in sql and '"api_profile"' in sql
+                             for sql in queries))
+
+    def test_omit(self):
+        data, queries = self.get('/api/recipes/',
+                                 {'limit': 3, 'omit': 'text,ingredients'})
+        self.assertNotIn('text', data['results'][0])
+        self.assertTrue(data['results'][0]['author']['is_subscribed'])
+        self.assertFalse(any('"api_ingredientamount"' in sql
+                             for sql in queries))
+
+    def test_subscriptions_without_recipes(self):
+        data, queries = self.get('/api/users/subscriptions/',
+                                 {'omit': 'recipes'})
+        self.assertEqual(data['results'][0]['recipes_count'], 10)
+        self.assertNotIn('recipes', data['results'][0])
+        self.assertFalse(any('FROM "api_recipe"' in sql for sql in queries))
+
+    def test_cached_detail_is_cut(self):
+        cache.clear()
+        recipe = self.user.favorite_list.first()
+        url = f'/api/recipes/{recipe.id}/'
+        self.client.get(url)
+        data, queries = self.get(url, {'fields': 'name,is_favorited'})
+        self.assertEqual(data, {'name': recipe.name, 'is_favorited': True})
+
+    def test_fast_renderer_matches_json_renderer(self):
+        data, _ = self.get('/api/recipes/', {'limit': 3})
+        self.assertEqual(
+            json.loads(renderers.FastJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+
+class SubscriptionsQueriesTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        for i in range(6):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass')
+            models.UserFollowing.objects.create(user=cls.user,
+                                                following_user=author)
+            models.Recipe.objects.bulk_create(
+                models.Recipe(author=author, name=f'Recipe {j}',
+                              image='r.png', text='text', cooking_time=10)
+                for j in range(i + 1)
+            )
+
+    def setUp(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def get_subscriptions(self, limit):
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/subscriptions/',
+                                       {'limit': limit, 'recipes_limit': 3})
+        self.assertEqual(response.status_code, 200)
+        return response, len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.assertEqual(self.get_subscriptions(2)[1],
+                         self.get_subscriptions(6)[1])
+
+    def test_recipes_are_limited_and_counted(self):
+        response, _ = self.get_subscriptions(6)
+        for author in response.data['results']:
+            self.assertLessEqual(len(author['recipes']), 3)
+            self.assertEqual(
+                author['recipes_count'],
+                models.Recipe.objects.filter(author_id=author['id']).count(),
+            )
+
+
+class DownloadShoppingCartTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        ingredient = models.Ingredient.objects.create(name='Сахар',
+                                                      measurement_unit='г')
+        for i in range(2):
+            recipe = models.Recipe.objects.create(
+                author=cls.user, name=f'Recipe {i}', image='r.png',
+                text='text', cooking_time=10)
+            models.IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=50)
+            cls.user.shopping_list.add(recipe)
+
+    def download(self, export_format):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipes/download_shopping_cart/',
+                                   {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_amounts_are_summed(self):
+        response, content = self.download('txt')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('1. Сахар: 100 г', content.decode())
+
+    def test_csv_export(self):
+        response, content = self.download('csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertIn('Сахар,100,г', content.decode())
+
+    def test_pdf_export(self):
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertTrue(content.endswith(b'%%EOF\n'))
+
+
+@skip_thumbnails
+class ShoppingSummaryTest(APITestCase):
+    url = '/api/recipes/shopping_cart/summary/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        ingredients = models.Ingredient.objects.bulk_create(
+            models.Ingredient(name='Сахар', measurement_unit=unit)
+            for unit in ('г', 'кг', 'стакан')
+        )
+        cls.recipes = []
+        for i, (ingredient, amount) in enumerate(zip(ingredients,
+                                                     (300, 2, 1))):
+            recipe = models.Recipe.objects.create(
+                author=cls.user, name=f'Recipe {i}', image='r.png',
+                text='text', cooking_time=10)
+            models.IngredientAmount.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount)
+            cls.recipes.append(recipe)
+        cls.user.shopping_list.add(*cls.recipes[:2])
+        models.Recipe.objects.reconcile_counters()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_units_are_merged(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data, {
+            'recipes': 2,
+            'ingredients': [{'name': 'Сахар', 'measurement_unit': 'г',
+                             'total_amount': 2300}],
+        })
+
+    def test_cart_changes_update_cached_summary(self):
+        self.client.get(self.url)
+        cart_url = f'/api/recipes/{self.recipes[2].id}/shopping_cart/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(cart_url)
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).data
+        self.assertEqual(data['recipes'], 3)
+        self.assertEqual(data['ingredients'][0]['measurement_unit'], 'г')
+        self.assertEqual(data['ingredients'][1], {
+            'name': 'Сахар', 'measurement_unit': 'мл', 'total_amount': 200})
+        cart_url = f'/api/recipes/{self.recipes[0].id}/shopping_cart/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(cart_url)
+        self.assertEqual(self.client.get(self.url).data['ingredients'], [
+            {'name': 'Сахар', 'measurement_unit': 'г', 'total_amount': 2000},
+            {'name': 'Сахар', 'measurement_unit': 'мл', 'total_amount': 200},
+        ])
+
+    def test_summary_built_before_a_change_is_not_served(self):
+        key = utils.get_summary_key(
+            self.user.pk, utils.get_summary_version(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.shopping_list.add(self.recipes[2])
+        # A rebuild that read the cart before the commit stores it late.
+        cache.add(key, {'recipes': {self.recipes[0].pk}, 'totals': {}})
+        self.assertEqual(self.client.get(self.url).data['recipes'], 3)
+
+    def test_ingredient_change_drops_summary(self):
+        self.client.get(self.url)
+        ingredient = models.Ingredient.objects.get(measurement_unit='г')
+        ingredient.name = 'Сахар-песок'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertEqual(
+            [item['name'] for item in self.client.get(self.url).data[
+                'ingredients']],
+            ['Сахар', 'Сахар-песок'],
+        )
+
+
+PNG = base64.b64encode(base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwAD'
+    'hgGAWjR9awAAAABJRU5ErkJggg=='
+)).decode()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeWriteQueriesTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.tags = models.Tag.objects.bulk_create(
+            models.Tag(name=f'Tag {i}', color=f'#00000{i}', slug=f'tag{i}')
+            for i in range(3)
+        )
+        cls.ingredients = models.Ingredient.objects.bulk_create(
+            models.Ingredient(name=f'Ingredient {i}', measurement_unit='г')
+            for i in range(30)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def recipe_data(self, ingredients, amount=10):
+        return {
+            'name': 'Recipe',
+            'text': 'text',
+            'cooking_time': 10,
+            'image': f'data:image/png;base64,{PNG}',
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in ingredients
+            ],
+        }
+
+    def create_recipe(self, ingredients):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                '/api/recipes/', self.recipe_data(ingredients),
+                format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(context.captured_queries)
+
+    def test_create_query_count_does_not_depend_on_ingredients(self):
+        self.assertEqual(self.create_recipe(self.ingredients[:2])[1],
+                         self.create_recipe(self.ingredients)[1])
+
+    def test_update_applies_ingredient_diff(self):
+        response, _ = self.create_recipe(self.ingredients[:20])
+        data = self.recipe_data(self.ingredients[10:], amount=5)
+        response = self.client.patch(
+            f'/api/recipes/{response.data["id"]}/', data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            {(item['id'], item['amount'])
+             for item in response.data['ingredients']},
+            {(ingredient.id, 5) for ingredient in self.ingredients[10:]},
+        )
+
+    def test_same_image_is_stored_once(self):
+        first, _ = self.create_recipe(self.ingredients[:1])
+        second, _ = self.create_recipe(self.ingredients[:1])
+        self.assertEqual(first.data['image'], second.data['image'])
+
+    def test_wrapped_base64_is_decoded(self):
+        content = bytes(range(256)) * 400
+        file = decode_base64(base64.encodebytes(content).decode(), 'png')
+        self.assertEqual(file.read(), content)
+
+    def test_list_serves_thumbnail(self):
+        response, _ = self.create_recipe(self.ingredients[:1])
+        recipe = models.Recipe.objects.get(pk=response.data['id'])
+        make_thumbnail(recipe.pk, recipe.image.name)
+        listed = self.client.get('/api/recipes/').data['results'][0]
+        self.assertIn('/thumbs/', listed['image'])
+        detail = self.client.get(f'/api/recipes/{recipe.pk}/').data
+        self.assertEqual(detail['image'], response.data['image'])
+
+    def test_unknown_ingredient_is_rejected(self):
+        data = self.recipe_data(self.ingredients[:1])
+        data['ingredients'].append({'id': 0, 'amount': 1})
+        response = self.client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(models.Recipe.objects.exists())
+
+
+class IngredientSearchTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        models.Ingredient.objects.bulk_create(
+            models.Ingredient(name=name, measurement_unit='г')
+            for name in ('варенье', 'абрикосовое варенье', 'Абрикосы',
+                         'сахар', 'абрикосовый джем')
+        )
+
+    def setUp(self):
+        ingredient_index.invalidate()
+
+    def search(self, name, **params):
+        response = self.client.get('/api/ingredients/',
+                                   {'name': name, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_matches_go_first(self):
+        self.assertEqual(
+            self.search('вар'),
+            ['варенье', 'абрикосовое варенье'],
+        )
+        self.assertEqual(
+            self.search('АБРИКОС'),
+            ['абрикосовое варенье', 'абрикосовый джем', 'Абрикосы'],
+        )
+
+    def test_fuzzy_matches_follow_prefix_matches(self):
+        self.assertEqual(self.search('абрикос варенье'), [])
+        names = self.search('абрикос варенье', fuzzy=1)
+        self.assertEqual(names[0], 'абрикосовое варенье')
+        names = self.search('варенье', fuzzy=1)
+        self.assertEqual(names[:2], ['варенье', 'абрикосовое варенье'])
+        self.assertEqual(len(names), len(set(names)))
+        self.assertEqual(self.search('сахр', fuzzy=1), ['сахар'])
+
+    def test_lookup_does_not_hit_database(self):
+        self.search('сах')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('сах'), ['сахар'])
+
+    def test_index_is_rebuilt_on_change(self):
+        self.search('мёд')
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Ingredient.objects.create(name='мёд', measurement_unit='г')
+            self.assertEqual(self.search('мёд'), [])
+        self.assertEqual(self.search('мёд'), ['мёд'])
+
+
+class ReferenceCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = models.Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                            slug='breakfast')
+
+    def test_repeat_fetch_is_not_modified(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache_is_invalidated_on_change(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Обед'
+            self.tag.save()
+            # The cache is only invalidated once the writer commits.
+            response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Обед')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class KeysetPaginationTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        authors = [
+            User.objects.create_user(username=f'author{i}',
+                                     email=f'author{i}@example.com',
+                                     password='pass')
+            for i in range(2)
+        ]
+        models.Recipe.objects.bulk_create(
+            models.Recipe(author=authors[i % 2], name=f'Recipe {i}',
+                          image='r.png', text='text', cooking_time=10)
+            for i in range(11)
+        )
+        cls.author = authors[0]
+
+    def walk(self, params):
+        url, ids = '/api/recipes/', []
+        params = {'cursor': '', 'limit': 3, **params}
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(' in query['sql']
+                                 for query in context.captured_queries))
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def test_walks_the_whole_feed_in_order(self):
+        expected = list(models.Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk({}), expected)
+
+    def test_equal_dates_are_ordered_by_id(self):
+        models.Recipe.objects.update(
+            pub_date=models.Recipe.objects.latest('pub_date').pub_date)
+        expected = list(models.Recipe.objects.order_by(
+            '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk({}), expected)
+
+    def test_filters_are_applied(self):
+        expected = list(models.Recipe.objects.filter(
+            author=self.author).order_by('-pub_date', '-id').values_list(
+                'id', flat=True))
+        self.assertEqual(self.walk({'author__id': self.author.id}),
+                         expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 404)
+
+
+class FeedTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        authors = [
+            User.objects.create_user(username=f'author{i}',
+                                     email=f'author{i}@example.com',
+                                     password='pass')
+            for i in range(3)
+        ]
+        models.Recipe.objects.bulk_create(
+            models.Recipe(author=authors[i % 3], name=f'Recipe {i}',
+                          image='r.png', text='text', cooking_time=10)
+            for i in range(12)
+        )
+        for author in authors[:2]:
+            models.UserFollowing.objects.create(user=cls.user,
+                                                following_user=author)
+        cls.authors = authors
+
+    def test_feed_walks_followed_authors_newest_first(self):
+        self.client.force_authenticate(self.user)
+        url, params, ids = '/api/recipes/feed/', {'limit': 3}, []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            recipe_queries = [
+                query for query in context.captured_queries
+                if query['sql'].startswith('SELECT "api_recipe"')
+            ]
+            self.assertEqual(len(recipe_queries), 1)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url, params = response.data['next'], None
+        expected = list(models.Recipe.objects.filter(
+            author__in=self.authors[:2]).order_by(
+                '-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_feed_requires_authentication(self):
+        self.assertEqual(self.client.get('/api/recipes/feed/').status_code,
+                         401)
+
+
+class RecipeCountersTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.recipes = models.Recipe.objects.bulk_create(
+            models.Recipe(author=cls.user, name=f'Recipe {i}', image='r.png',
+                          text='text', cooking_time=10)
+            for i in range(3)
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_counters_follow_favorite_and_cart(self):
+        recipe = self.recipes[0]
+        for endpoint in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{recipe.id}/{endpoint}/'
+            self.assertEqual(self.client.post(url).status_code, 201)
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.favorites_count, recipe.in_carts_count),
+                         (1, 1))
+        self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.favorites_count, recipe.in_carts_count),
+                         (0, 1))
+
+    def test_changes_are_counted_once(self):
+        view = views.RecipeViewSet()
+        recipe = self.recipes[0]
+        for adding in (True, True, False, False):
+            view.change_list(self.user.favorite_list, [recipe.pk], adding,
+                             'favorites_count')
+            recipe.refresh_from_db()
+            self.assertEqual(recipe.favorites_count, int(adding))
+
+    def test_reconcile_command(self):
+        self.user.favorite_list.add(self.recipes[1])
+        call_command('reconcilecounters', stdout=StringIO())
+        self.recipes[1].refresh_from_db()
+        self.assertEqual(self.recipes[1].favorites_count, 1)
+
+    def test_ordering_by_favorites_count(self):
+        models.Recipe.objects.filter(pk=self.recipes[1].pk).update(
+            favorites_count=5)
+        response = self.client.get('/api/recipes/',
+                                   {'ordering': '-favorites_count'})
+        self.assertEqual(response.data['results'][0]['id'],
+                         self.recipes[1].id)
+
+
+class BulkListChangesTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.recipes = models.Recipe.objects.bulk_create(
+            models.Recipe(author=cls.user, name=f'Recipe {i}', image='r.png',
+                          text='text', cooking_time=10)
+            for i in range(6)
+        )
+        cls.user.shopping_list.add(cls.recipes[0])
+        models.Recipe.objects.reconcile_counters()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def change(self, method, ids):
+        response = getattr(self.client, method)(
+            '/api/recipes/shopping_cart/', {'recipes': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [item['result'] for item in response.data['results']]
+
+    def test_add_and_remove_report_each_recipe(self):
+        ids = [recipe.id for recipe in self.recipes]
+        missing = ids[-1] + 100
+        self.assertEqual(
+            self.change('post', ids[:3] + [ids[1], missing]),
+            ['already_added', 'added', 'added', 'not_found'],
+        )
+        self.assertEqual(
+            set(self.user.shopping_list.values_list('pk', flat=True)),
+            set(ids[:3]),
+        )
+        self.assertEqual(
+            self.change('delete', [ids[0], ids[3]]),
+            ['removed', 'not_listed'],
+        )
+        self.assertEqual(
+            list(models.Recipe.objects.filter(pk__in=ids[:4]).order_by(
+                'pk').values_list('in_carts_count', flat=True)),
+            [0, 1, 1, 0],
+        )
+
+    def test_query_count_does_not_depend_on_size(self):
+        ids = [recipe.id for recipe in self.recipes]
+        with CaptureQueriesContext(connection) as small:
+            self.change('post', ids[1:3])
+        with CaptureQueriesContext(connection) as large:
+            self.change('post', ids[3:])
+        self.assertEqual(len(small), len(large))
+
+    def test_invalid_ids_are_reported(self):
+        response = self.client.post('/api/recipes/favorite/',
+                                    {'recipes': ['x', 1]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('0', json.loads(response.content)['recipes'])
+
+    def test_empty_list_is_rejected(self):
+        response = self.client.post('/api/recipes/favorite/',
+                                    {'recipes': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RecipeFilterTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        tags = models.Tag.objects.bulk_create(
+            models.Tag(name=f'Tag {i}', color=f'#00000{i}', slug=f'tag{i}')
+            for i in range(2)
+        )
+        cls.recipes = models.Recipe.objects.bulk_create(
+            models.Recipe(author=author, name=f'Recipe {i}', image='r.png',
+                          text='text', cooking_time=10)
+            for i, author in enumerate((cls.user, cls.other, cls.other))
+        )
+        cls.recipes[0].tags.add(*tags)
+        cls.recipes[1].tags.add(tags[1])
+        cls.user.favorite_list.add(*cls.recipes[:2])
+
+    def get_ids(self, params):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'],
+                         len(response.data['results']))
+        return sorted(recipe['id'] for recipe in response.data['results'])
+
+    def test_several_tags_do_not_duplicate_recipes(self):
+        self.assertEqual(self.get_ids({'tags': ['tag0', 'tag1']}),
+                         [self.recipes[0].id, self.recipes[1].id])
+
+    def test_favorites_keep_other_filters(self):
+        self.assertEqual(
+            self.get_ids({'is_favorited': 1, 'author__id': self.other.id}),
+            [self.recipes[1].id],
+        )
+
+    def test_search_combines_with_filters(self):
+        ingredient = models.Ingredient.objects.create(
+            name='абрикосы', measurement_unit='г')
+        models.IngredientAmount.objects.bulk_create(
+            models.IngredientAmount(recipe=recipe, ingredient=ingredient,
+                                    amount=10)
+            for recipe in self.recipes[1:]
+        )
+        self.assertEqual(
+            self.get_ids({'search': 'абрикос', 'tags': ['tag1']}),
+            [self.recipes[1].id],
+        )
+        self.assertEqual(self.get_ids({'search': 'Recipe 0'}),
+                         [self.recipes[0].id])
+
+
+@skip_thumbnails
+class RecipeDetailCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.recipe = models.Recipe.objects.create(
+            author=cls.author, name='Recipe', image='r.png', text='text',
+            cooking_time=10)
+        cls.url = f'/api/recipes/{cls.recipe.id}/'
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        token = Token.objects.create(user=self.user)
+        self.credentials = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+    def test_anonymous_hit_runs_no_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['name'], 'Recipe')
+        self.assertFalse(response.data['is_favorited'])
+
+    def test_user_flags_are_overlaid(self):
+        self.user.favorite_list.add(self.recipe)
+        models.UserFollowing.objects.create(user=self.user,
+                                            following_user=self.author)
+        self.client.get(self.url)
+        self.client.get(self.url, **self.credentials)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, **self.credentials)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertFalse(response.data['is_in_shopping_cart'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        self.assertFalse(self.client.get(self.url).data['is_favorited'])
+
+    @override_settings(RECIPE_CACHE_TIMEOUT=600, RECIPE_CACHE_LOCAL_TIMEOUT=10)
+    def test_local_cache_keeps_entries_briefly(self):
+        self.assertEqual(caching.get_recipe_cache_timeout(), 10)
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(caching.get_recipe_cache_timeout(), 600)
+
+    def test_recipe_deleted_elsewhere_is_not_found(self):
+        self.client.get(self.url)
+        # Skip the signals, as if the cache was not cleared after a delete.
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_recipe WHERE id = %s',
+                           [self.recipe.pk])
+        response = self.client.get(self.url, **self.credentials)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_invalidation(self):
+        self.client.get(self.url, **self.credentials)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.shopping_list.add(self.recipe)
+            self.recipe.name = 'Renamed'
+            self.recipe.save()
+            # The cache is only invalidated once the writer commits.
+            response = self.client.get(self.url, **self.credentials)
+            self.assertEqual(response.data['name'], 'Recipe')
+        response = self.client.get(self.url, **self.credentials)
+        self.assertEqual(response.data['name'], 'Renamed')
+        self.assertTrue(response.data['is_in_shopping_cart'])
+
+
+class RequestMetricsTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        models.Recipe.objects.bulk_create(
+            models.Recipe(author=cls.admin, name=f'Recipe {i}',
+                          image='r.png', text='text', cooking_time=10)
+            for i in range(3)
+        )
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/recipes/')
+        self.assertRegex(response['Server-Timing'],
+                         r'db;dur=[\d.]+;desc="\d+ queries"')
+
+    def test_server_timing_is_hidden_from_other_users(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/recipes/'))
+        with override_settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get('/api/recipes/'))
+
+    def test_streaming_response_has_no_server_timing(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertTrue(response.streaming)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/recipes/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(
+            response.data['views']['RecipeViewSet.list']['requests'], 1)
+
+    @override_settings(API_DUPLICATE_QUERY_THRESHOLD=1)
+    def test_repeated_queries_are_logged(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get('/api/recipes/')
+        self.assertIn('RecipeViewSet.list ran a statement', logs.output[0])
+
+
+class TokenCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+
+    def setUp(self):
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_is_cached(self):
+        self.client.get('/api/users/me/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['username'], 'reader')
+        self.assertFalse(any('authtoken_token' in query['sql']
+                             for query in queries.captured_queries))
+
+    @override_settings(TOKEN_CACHE='default')
+    def test_shared_tier_is_used_after_local_miss(self):
+        cache.clear()
+        self.client.get('/api/users/me/')
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/users/me/')
+        self.assertFalse(any('authtoken_token' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_logout_drops_token(self):
+        self.client.get('/api/users/me/')
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_user_change_drops_token(self):
+        self.client.get('/api/users/me/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+class ReplicaRouterTest(APITestCase):
+    def test_reads_follow_request_alias(self):
+        token = read_alias.set('replica')
+        try:
+            self.assertEqual(models.Recipe.objects.all().db, 'replica')
+            with primary():
+                self.assertEqual(models.Recipe.objects.all().db, 'default')
+        finally:
+            read_alias.reset(token)
+        self.assertEqual(models.Recipe.objects.all().db, 'default')
+
+    def test_write_pins_user_to_primary(self):
+        user = User.objects.create_user(
+            username='writer', email='writer@example.com', password='pass')
+        recipe = models.Recipe.objects.create(
+            author=user, name='Recipe', image='r.png', text='text',
+            cooking_time=10)
+        cache.clear()
+        self.client.force_authenticate(user)
+        self.assertFalse(is_pinned(user))
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertTrue(is_pinned(user))
+
+
+class ReplicaPinCacheCheckTest(SimpleTestCase):
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_local_cache_with_replicas_is_an_error(self):
+        errors = check_replica_pin_cache(None)
+        self.assertEqual([error.id for error in errors], ['api.E001'])
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(check_replica_pin_cache(None), [])
+
+    def test_no_replicas(self):
+        self.assertEqual(check_replica_pin_cache(None), [])
+
+
+@skipUnless('replica' in settings.DATABASES,
+            'needs a second database alias named replica')
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaReadsTest(APITestCase):
+    # The test runner collects databases of skipped classes too.
+    databases = ({'default', 'replica'} if 'replica' in settings.DATABASES
+                 else {'default'})
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.recipe = models.Recipe.objects.create(
+            author=cls.user, name='Recipe', image='r.png', text='text',
+            cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_safe_requests_read_from_replica(self):
+        # The replica test database is empty, the recipe is only on default.
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 0)
+
+    def test_writer_reads_own_writes(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 0)
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 1)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 0)
+
+
+class BenchmarkCommandsTest(APITestCase):
+    def test_generate_and_benchmark(self):
+        data = settings.BASE_DIR.parent / 'data'
+        call_command('generatedata', users=3, recipes_per_user=2,
+                     ingredients=data / 'ingredients.csv',
+                     tags=data / 'tags.csv', stdout=StringIO())
+        self.assertEqual(models.Recipe.objects.count(), 6)
+        self.assertTrue(models.UserFollowing.objects.exists())
+        output = Path(tempfile.mkdtemp()) / 'benchmark.json'
+        call_command('benchmark', requests=2, output=output,
+                     stdout=StringIO())
+        results = json.loads(output.read_text())['results']
+        self.assertEqual(results['recipe_list']['status'], [200])
+        self.assertIn('p99_ms', results['subscriptions'])
+
+
+class LoadDataCommandsTest(APITestCase):
+    data = settings.BASE_DIR.parent / 'data'
+
+    def load(self, command, path, **options):
+        stdout = StringIO()
+        call_command(command, str(path), stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_formats_load_the_same_ingredients(self):
+        output = self.load('loadingredients', self.data / 'ingredients.csv',
+                           batch_size=300)
+        count = models.Ingredient.objects.count()
+        self.assertIn(f'{count} inserted, 0 updated, 0 skipped', output)
+        for name in ('ingredients.json', 'data_from_db.json'):
+            output = self.load('loadingredients', self.data / name)
+            self.assertIn(f'0 inserted, 0 updated, {count} skipped', output)
+        self.assertEqual(models.Ingredient.objects.count(), count)
+
+    def test_tags_are_updated_by_slug(self):
+        self.load('loadtags', self.data / 'tags.csv')
+        slug = models.Tag.objects.values_list('slug', flat=True).first()
+        path = Path(tempfile.mkdtemp()) / 'tags.json'
+        path.write_text(json.dumps(
+            [{'name': 'Новый', 'color': '#000000', 'slug': slug}]))
+        output = self.load('loadtags', path)
+        self.assertIn('0 inserted, 1 updated, 0 skipped', output)
+        self.assertEqual(models.Tag.objects.get(slug=slug).name, 'Новый')
+
+    def write_tags(self, tags):
+        path = Path(tempfile.mkdtemp()) / 'tags.json'
+        path.write_text(json.dumps(tags))
+        return path
+
+    def test_tag_clashing_on_name_is_not_counted(self):
+        models.Tag.objects.create(name='Завтрак', color='#000000',
+                                  slug='breakfast')
+        stderr = StringIO()
+        path = self.write_tags([
+            {'name': 'Завтрак', 'color': '#111111', 'slug': 'morning'},
+            {'name': 'Обед', 'color': '#222222', 'slug': 'lunch'},
+        ])
+        output = self.load('loadtags', path, stderr=stderr)
+        self.assertIn('1 inserted, 0 updated, 1 skipped', output)
+        self.assertIn("name='Завтрак' already exists", stderr.getvalue())
+        self.assertFalse(models.Tag.objects.filter(slug='morning').exists())
+
+    def test_update_clashing_on_color_is_an_error(self):
+        models.Tag.objects.bulk_create([
+            models.Tag(name='Завтрак', color='#000000', slug='breakfast'),
+            models.Tag(name='Обед', color='#111111', slug='lunch'),
+        ])
+        path = self.write_tags(
+            [{'name': 'Обед', 'color': '#000000', 'slug': 'lunch'}])
+        with self.assertRaisesMessage(CommandError,
+                                      "color='#000000' already exists"):
+            self.load('loadtags', path)
+        self.assertEqual(models.Tag.objects.get(slug='lunch').color,
+                         '#111111')
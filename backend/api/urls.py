@@ -10,6 +10,7 @@ router.register(r'recipes', views.RecipeViewSet)
 router.register(r'users', views.ProfileViewSet)
 
 urlpatterns = [
+    path('api/metrics/', views.MetricsView.as_view(), name='metrics'),
     path('api/', include(router.urls)),
     path('api/', include('djoser.urls')),
     path('api/auth/', include('djoser.urls.authtoken')),
@@ -1,23 +1,149 @@
-from django.http import HttpResponse
+from time import time
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
 
-def make_text(queryset):
-    output = []
-    output.append('Your shopping list')
-    output.append('\n')
-    for i, obj in enumerate(queryset):
-        line = f'{i+1}. {obj.name}: {obj.total_amount} {obj.measurement_unit}'
-        output.append(line)
-    return '\n'.join(output)
+from api.models import Ingredient, IngredientAmount, Profile
+from api.replicas import primary
 
 
-def create_txt(queryset):
-    text = make_text(queryset)
-    response = HttpResponse(
-        text,
-        'Content-Type: application/pdf',
+def get_shopping_list(user):
+    """Ingredient totals for the user's cart, aggregated in the database."""
+    return Ingredient.objects.filter(
+        ingredientamount__recipe__added_to_cart=user
+    ).values('name', 'measurement_unit').annotate(
+        total_amount=Sum('ingredientamount__amount')
+    ).order_by('name')
+
+
+def create_shopping_list_response(queryset, renderer):
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = f'{content_type}; charset={renderer.charset}'
+    filename = f'shopping_list.{renderer.format}'
+    return StreamingHttpResponse(
+        renderer.stream(queryset.iterator()),
+        content_type=content_type,
         headers={
-            "Content-Disposition": 'attachment; filename="shopping_list.txt"'
+            "Content-Disposition": f'attachment; filename="{filename}"'
         }
     )
-    return response
+
+
+def convert_amount(amount, measurement_unit):
+    """Express `amount` in the base unit from SHOPPING_UNIT_CONVERSIONS."""
+    base_unit, factor = settings.SHOPPING_UNIT_CONVERSIONS.get(
+        measurement_unit, (measurement_unit, 1))
+    return amount * factor, base_unit
+
+
+def add_to_totals(totals, name, measurement_unit, amount):
+    amount, measurement_unit = convert_amount(amount, measurement_unit)
+    key = (name, measurement_unit)
+    totals[key] = totals.get(key, 0) + amount
+    if not totals[key]:
+        del totals[key]
+
+
+def get_summary_key(user_id, version):
+    return f'shopping-summary:{user_id}:{version}'
+
+
+def get_summary_version(user_id):
+    return cache.get_or_set(f'shopping-summary:{user_id}:version',
+                            lambda: int(time() * 1000), timeout=None)
+
+
+def bump_summary_version(user_id):
+    """Start a new summary generation and return its number.
+
+    `cache.incr` is atomic, so concurrent writers always get distinct
+    generations, and a summary built before a change can only be stored
+    under a generation nobody reads any more.
+    """
+    key = f'shopping-summary:{user_id}:version'
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_summary_version(user_id)
+        return cache.incr(key)
+
+
+def get_shopping_summary(user):
+    """Cart totals with units normalised, cached per user.
+
+    Totals are summed in one grouped query and the recipe ids read by a
+    second one; the generation is read first, so a cart change committed
+    between the two leaves the entry under a generation nobody reads. The
+    cached entry keeps the ids of the recipes it was built from, so
+    `update_shopping_summary` can apply cart changes to it incrementally.
+    """
+    key = get_summary_key(user.pk, get_summary_version(user.pk))
+    summary = cache.get(key)
+    if summary is None:
+        totals = {}
+        with primary():
+            for row in get_shopping_list(user):
+                add_to_totals(totals, row['name'], row['measurement_unit'],
+                              row['total_amount'])
+            recipes = set(user.shopping_list.values_list('pk', flat=True))
+        summary = {'recipes': recipes, 'totals': totals}
+        cache.add(key, summary, settings.SHOPPING_SUMMARY_TIMEOUT)
+    return {
+        'recipes': len(summary['recipes']),
+        'ingredients': [
+            {'name': name, 'measurement_unit': measurement_unit,
+             'total_amount': amount}
+            for (name, measurement_unit), amount in sorted(
+                summary['totals'].items())
+        ],
+    }
+
+
+def update_shopping_summary(user_id, added=(), removed=()):
+    """Apply recipes added to or removed from a cart to its cached summary.
+
+    The change is carried from the previous generation to a new one, so a
+    concurrent update or rebuild never overwrites it. Recipes the summary
+    already has, or never had, are skipped, so the totals stay right
+    whatever `m2m_changed` reports.
+    """
+    version = bump_summary_version(user_id)
+    summary = cache.get(get_summary_key(user_id, version - 1))
+    if summary is None:
+        return
+    added = set(added) - summary['recipes']
+    removed = set(removed) & summary['recipes']
+    rows = IngredientAmount.objects.filter(
+        recipe_id__in=added | removed,
+    ).values_list('recipe_id', 'ingredient__name',
+                  'ingredient__measurement_unit', 'amount')
+    for recipe_id, name, measurement_unit, amount in rows:
+        sign = 1 if recipe_id in added else -1
+        add_to_totals(summary['totals'], name, measurement_unit,
+                      sign * amount)
+    summary['recipes'] = (summary['recipes'] | added) - removed
+    cache.add(get_summary_key(user_id, version), summary,
+              settings.SHOPPING_SUMMARY_TIMEOUT)
+
+
+def invalidate_shopping_summaries(user_ids):
+    user_ids = list(user_ids)
+
+    def bump_summary_versions():
+        for user_id in user_ids:
+            bump_summary_version(user_id)
+
+    if user_ids:
+        transaction.on_commit(bump_summary_versions)
+
+
+def invalidate_recipe_shopping_summaries(recipe_ids):
+    """Drop summaries of every cart holding one of the recipes."""
+    invalidate_shopping_summaries(
+        Profile.shopping_list.through.objects.filter(
+            recipe_id__in=recipe_ids,
+        ).values_list('profile_id', flat=True).distinct())
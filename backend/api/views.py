@@ -1,4 +1,5 @@
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, Prefetch
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
 from django_filters import rest_framework
@@ -7,16 +8,24 @@ from djoser.views import UserViewSet
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.settings import api_settings
 
-from api import models, serializers
+from api import models, renderers, serializers
+from api.caching import ConditionalCacheMixin, RecipeDetailCacheMixin
 from api.permissions import IsAuthorOrReadOnly
 from api.filters import RecipeFilter
-from api.utils import create_txt
+from api.metrics import metrics
+from api.pagination import KeysetPagination
+from api.replicas import ReplicaReadMixin
+from api.search import ingredient_index
+from api.utils import (create_shopping_list_response, get_shopping_list,
+                       get_shopping_summary)
 
 User = get_user_model()
 
 
-class ProfileViewSet(UserViewSet):
+class ProfileViewSet(ReplicaReadMixin, UserViewSet):
     queryset = User.objects.all().prefetch_related(
         'following').prefetch_related('followers').order_by('id')
     allowed_methods = ('post', 'get')
@@ -38,20 +47,38 @@ class ProfileViewSet(UserViewSet):
             return serializers.ProfileSerializer
         return super().get_serializer_class()
 
+    def get_recipes_limit(self):
+        try:
+            return max(int(self.request.query_params.get(
+                "recipes_limit",
+                settings.LIMIT_RECIPES,
+            )), 0)
+        except ValueError:
+            return settings.LIMIT_RECIPES
+
     def get_serializer_context(self):
         data = super().get_serializer_context()
-        recipes_limit = self.request.query_params.get(
-            "recipes_limit",
-            settings.LIMIT_RECIPES,
-        )
-        data['recipes_limit'] = recipes_limit
+        data['recipes_limit'] = self.get_recipes_limit()
         return data
 
     @action(detail=False, methods=['get'],
             permission_classes=[permissions.IsAuthenticated])
     def subscriptions(self, request):
         user = self.get_instance()
+        fields = serializers.get_sparse_fields(
+            request, serializers.SubscriptionsSerializer.Meta.fields)
         queryset = User.objects.filter(followers__user=user).order_by('id')
+        if 'recipes_count' in fields:
+            queryset = queryset.annotate(recipes_count=Count('recipes'))
+        if 'recipes' in fields:
+            recipes = models.Recipe.objects.only(
+                'id', 'name', 'image', 'thumbnail', 'cooking_time',
+                'author_id')
+            queryset = queryset.prefetch_related(
+                Prefetch('recipes',
+                         queryset=recipes[:self.get_recipes_limit()],
+                         to_attr='limited_recipes'),
+            )
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -84,31 +111,83 @@ class ProfileViewSet(UserViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReplicaReadMixin, ConditionalCacheMixin,
+                 viewsets.ReadOnlyModelViewSet):
     queryset = models.Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    authentication_classes = ()
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, ConditionalCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = models.Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
-    filter_backends = (filters.SearchFilter, )
-    search_fields = ('^name', )
+    authentication_classes = ()
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get(api_settings.SEARCH_PARAM)
+        if name:
+            fuzzy = request.query_params.get('fuzzy') in ('1', 'true')
+            return Response(ingredient_index.search(name, fuzzy=fuzzy))
+        return super().list(request, *args, **kwargs)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = models.Recipe.objects.all().select_related(
-        'author').prefetch_related('tags', 'ingredients')
+class RecipeViewSet(ReplicaReadMixin, RecipeDetailCacheMixin,
+                    viewsets.ModelViewSet):
+    queryset = models.Recipe.objects.defer('search_vector')
     serializer_class = serializers.RecipeSerializer
     permission_classes = (IsAuthorOrReadOnly, )
-    filter_backends = (rest_framework.DjangoFilterBackend, )
+    filter_backends = (rest_framework.DjangoFilterBackend,
+                       filters.OrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count', 'in_carts_count')
+
+    def get_queryset(self):
+        """Join, prefetch and annotate only what the response includes."""
+        queryset = super().get_queryset()
+        fields = serializers.get_sparse_fields(
+            self.request, serializers.RecipeSerializer.Meta.fields)
+        if 'author' in fields:
+            queryset = queryset.select_related('author')
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related('tags')
+        if 'ingredients' in fields:
+            queryset = queryset.prefetch_related(Prefetch(
+                'ingredientamount_set',
+                queryset=models.IngredientAmount.objects.select_related(
+                    'ingredient').order_by('ingredient__name'),
+                to_attr='ingredient_amounts',
+            ))
+        if 'text' not in fields:
+            queryset = queryset.defer('text')
+        if {'is_favorited', 'is_in_shopping_cart'} & set(fields):
+            queryset = queryset.annotate_user_flags(self.request.user)
+        return queryset
+
+    @property
+    def paginator(self):
+        """Opt into keyset pagination by passing a `cursor` parameter.
+
+        Keyset pagination only follows the default ordering, so it is not
+        used together with an `ordering` or `search` parameter.
+        """
+        if not hasattr(self, '_paginator'):
+            params = self.request.GET
+            if (KeysetPagination.cursor_query_param in params
+                    and api_settings.ORDERING_PARAM not in params
+                    and 'search' not in params):
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
 
     def get_serializer_class(self):
         if self.action in ('favorite', 'shopping_cart'):
             return serializers.FavoriteShoppingCartSerializer
+        if self.action in ('favorite_bulk', 'shopping_cart_bulk'):
+            return serializers.RecipeIdsSerializer
         return super().get_serializer_class()
 
     @action(detail=True, methods=['post', 'delete'])
@@ -124,7 +203,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                          'delete': True},
             )
             serializer.is_valid(raise_exception=True)
-            user.favorite_list.remove(recipe)
+            self.change_list(user.favorite_list, [recipe.pk], False,
+                             'favorites_count')
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         serializer = self.get_serializer(
@@ -135,7 +215,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                      'delete': False},
         )
         serializer.is_valid(raise_exception=True)
-        user.favorite_list.add(recipe)
+        self.change_list(user.favorite_list, [recipe.pk], True,
+                         'favorites_count')
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post', 'delete'])
@@ -151,7 +232,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                          'delete': True},
             )
             serializer.is_valid(raise_exception=True)
-            user.shopping_list.remove(recipe)
+            self.change_list(user.shopping_list, [recipe.pk], False,
+                             'in_carts_count')
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         serializer = self.get_serializer(
@@ -162,14 +244,104 @@ class RecipeViewSet(viewsets.ModelViewSet):
                      'delete': False},
         )
         serializer.is_valid(raise_exception=True)
-        user.shopping_list.add(recipe)
+        self.change_list(user.shopping_list, [recipe.pk], True,
+                         'in_carts_count')
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    @action(detail=False, methods=['get'])
+    @action(detail=False, methods=['post', 'delete'], url_path='favorite',
+            url_name='favorite-bulk',
+            permission_classes=[permissions.IsAuthenticated])
+    def favorite_bulk(self, request):
+        return self.change_list_in_bulk(request, request.user.favorite_list,
+                                        'favorites_count')
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart', url_name='shopping-cart-bulk',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        return self.change_list_in_bulk(request, request.user.shopping_list,
+                                        'in_carts_count')
+
+    def change_list(self, recipes, pks, adding, counter):
+        """Add or remove recipes in a user's list and return those changed.
+
+        The user's row is locked and membership is read again under the lock,
+        so counters move by the rows actually changed even when requests of
+        the same user race each other.
+        """
+        with transaction.atomic():
+            models.Profile.objects.select_for_update().only('pk').get(
+                pk=recipes.instance.pk)
+            listed = set(recipes.filter(pk__in=pks).values_list(
+                'pk', flat=True))
+            changed = set(pks) - listed if adding else listed
+            if changed:
+                if adding:
+                    recipes.add(*changed)
+                else:
+                    recipes.remove(*changed)
+                models.Recipe.objects.filter(pk__in=changed).increment(
+                    counter, 1 if adding else -1)
+        return changed
+
+    def change_list_in_bulk(self, request, recipes, counter):
+        """Add or remove many recipes and report the outcome for each.
+
+        Existence and membership of all ids are checked in one query, the
+        changes are written with one insert or delete on the through table.
+        Ids another request has changed meanwhile are reported as unchanged.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        adding = request.method == 'POST'
+        listed = dict(models.Recipe.objects.filter(pk__in=ids).annotate(
+            listed=models.RecipeQuerySet.in_list_of(recipes.through,
+                                                    request.user),
+        ).values_list('pk', 'listed'))
+        changed = {pk for pk, is_listed in listed.items()
+                   if is_listed != adding}
+        if changed:
+            changed = self.change_list(recipes, changed, adding, counter)
+        results = []
+        for pk in ids:
+            if pk not in listed:
+                result = 'not_found'
+            elif pk in changed:
+                result = 'added' if adding else 'removed'
+            else:
+                result = 'already_added' if adding else 'not_listed'
+            results.append({'id': pk, 'result': result})
+        return Response({'results': results})
+
+    @action(detail=False, methods=['get'], url_path='shopping_cart/summary',
+            permission_classes=[permissions.IsAuthenticated])
+    def shopping_cart_summary(self, request):
+        return Response(get_shopping_summary(request.user))
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        """Recipes of followed authors, newest first, by keyset pages."""
+        queryset = self.get_queryset().followed_by(request.user)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[permissions.IsAuthenticated],
+            renderer_classes=[renderers.TextShoppingListRenderer,
+                              renderers.CSVShoppingListRenderer,
+                              renderers.PDFShoppingListRenderer])
     def download_shopping_cart(self, request):
-        user = request.user
-        shopping_list = user.shopping_list.all()
-        queryset = models.Ingredient.objects.filter(
-            ingredientamount__recipe__in=shopping_list
-        ).annotate(total_amount=Sum('ingredientamount__amount'))
-        return create_txt(queryset)
+        queryset = get_shopping_list(request.user)
+        return create_shopping_list_response(queryset,
+                                             request.accepted_renderer)
+
+
+class MetricsView(APIView):
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response(metrics.snapshot())
@@ -9,7 +9,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = getenv('SECRET_KEY', default='key')
 
-DEBUG = getenv('DEBUG', default=False)
+DEBUG = getenv('DEBUG', 'false') == 'true'
 
 ALLOWED_HOSTS = getenv('ALLOWED_HOSTS', default='127.0.0.1').split(',')
 
@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -29,6 +30,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -64,7 +66,37 @@ DATABASES = {
         'USER': getenv('POSTGRES_USER', 'django'),
         'PASSWORD': getenv('POSTGRES_PASSWORD', ''),
         'HOST': getenv('DB_HOST', ''),
-        'PORT': getenv('DB_PORT', 5432)
+        'PORT': getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': getenv('DB_CONN_HEALTH_CHECKS',
+                                     'true') == 'true',
+        'DISABLE_SERVER_SIDE_CURSORS': getenv(
+            'DB_DISABLE_SERVER_SIDE_CURSORS', 'false') == 'true',
+    }
+}
+
+DATABASE_REPLICAS = []
+
+for number, host in enumerate(
+        filter(None, getenv('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+REPLICA_PIN_TIMEOUT = int(getenv('REPLICA_PIN_TIMEOUT', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': getenv('CACHE_LOCATION', ''),
     }
 }
 
@@ -107,7 +139,11 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
     'PAGE_SIZE': 6,
@@ -128,3 +164,54 @@ DJOSER = {
     },
     'LIMIT_RECIPES': 5,
 }
+
+TOKEN_CACHE = getenv('TOKEN_CACHE', '')
+
+TOKEN_CACHE_TIMEOUT = int(getenv('TOKEN_CACHE_TIMEOUT', 60))
+
+TOKEN_CACHE_LOCAL_TIMEOUT = int(getenv('TOKEN_CACHE_LOCAL_TIMEOUT', 10))
+
+TOKEN_CACHE_SIZE = int(getenv('TOKEN_CACHE_SIZE', 1024))
+
+INGREDIENT_SEARCH_LIMIT = int(getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+INGREDIENT_FUZZY_LIMIT = int(getenv('INGREDIENT_FUZZY_LIMIT', 10))
+
+INGREDIENT_INDEX_TTL = int(getenv('INGREDIENT_INDEX_TTL', 300))
+
+REFERENCE_CACHE_TIMEOUT = int(getenv('REFERENCE_CACHE_TIMEOUT', 300))
+
+REFERENCE_CACHE_MAX_AGE = int(getenv('REFERENCE_CACHE_MAX_AGE', 60))
+
+RECIPE_CACHE = getenv('RECIPE_CACHE', 'default')
+
+RECIPE_CACHE_TIMEOUT = int(getenv('RECIPE_CACHE_TIMEOUT', 600))
+
+RECIPE_CACHE_LOCAL_TIMEOUT = int(getenv('RECIPE_CACHE_LOCAL_TIMEOUT', 10))
+
+SHOPPING_SUMMARY_TIMEOUT = int(getenv('SHOPPING_SUMMARY_TIMEOUT', 600))
+
+# Units merged in the shopping cart summary: unit -> (base unit, factor).
+SHOPPING_UNIT_CONVERSIONS = {
+    'кг': ('г', 1000),
+    'л': ('мл', 1000),
+    'стакан': ('мл', 200),
+}
+
+RECIPE_SEARCH_CONFIG = getenv('RECIPE_SEARCH_CONFIG', 'russian')
+
+API_METRICS_ENABLED = getenv('API_METRICS_ENABLED', 'true') == 'true'
+
+API_METRICS_FILE = getenv('API_METRICS_FILE', '')
+
+API_METRICS_FLUSH_INTERVAL = int(getenv('API_METRICS_FLUSH_INTERVAL', 60))
+
+API_DUPLICATE_QUERY_THRESHOLD = int(
+    getenv('API_DUPLICATE_QUERY_THRESHOLD', 10))
+
+THUMBNAIL_SIZE = (int(getenv('THUMBNAIL_WIDTH', 480)),
+                  int(getenv('THUMBNAIL_HEIGHT', 480)))
+
+THUMBNAIL_QUALITY = int(getenv('THUMBNAIL_QUALITY', 80))
+
+THUMBNAIL_WORKERS = int(getenv('THUMBNAIL_WORKERS', 2))
@@ -0,0 +1,31 @@
+"""Gunicorn settings, tuned with environment variables.
+
+Set GUNICORN_ASGI=true to serve `foodgram.asgi` with uvicorn workers.
+"""
+import multiprocessing
+from os import getenv
+
+bind = getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Each thread may keep a database connection open, so the default is capped
+# to keep workers * threads well under PostgreSQL's max_connections.
+workers = int(getenv('GUNICORN_WORKERS',
+                     min(multiprocessing.cpu_count() * 2 + 1, 8)))
+
+worker_class = getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+threads = int(getenv('GUNICORN_THREADS', 4))
+
+timeout = int(getenv('GUNICORN_TIMEOUT', 30))
+
+keepalive = int(getenv('GUNICORN_KEEPALIVE', 5))
+
+max_requests = int(getenv('GUNICORN_MAX_REQUESTS', 1000))
+
+max_requests_jitter = int(getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+wsgi_app = 'foodgram.wsgi'
+
+if getenv('GUNICORN_ASGI', 'false') == 'true':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'